@@ -17,7 +17,7 @@ from matplotlib.collections import PatchCollection
 ################### LOAD THE EXPERIMENTS ###################
 input_path = "temp/experiments/experiment_selection_2021_1_19.p"
 assert Path(input_path).exists()
-experiments = pickle.load( open( input_path, "rb" ) )
+experiments = load_experiments(input_path) #a pickle, or the folder of an ExperimentStore
 
 ############# SELECT INTERESTING EXPERIMENTS ###############
 selection = sel_exp(experiments,SLR_scenarios='03',SurgeHeights='five_hundred_3',Mayors='Sentiment',ITs=(4,6))
@@ -8,17 +8,23 @@ github.com/keesvanginkel
 
 __author__ = '{Kees van Ginkel}'
 
+import copy
 import csv
+import heapq
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
 import pickle
+import shutil
+import tempfile
 
 from abc import ABC, abstractmethod
 from copy import deepcopy
 from math import log, exp
 from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
 
 import tipping as tp
 
@@ -29,10 +35,8 @@ import tipping as tp
 allSLR_Scenario = []
 allSurgeHeight = []
 allSurgeLevel = []
-allactiveMeasure = []
 
 #In a next version, add a generic class to track allSLR_Scenario, allSurgeHeight, allSurgeLevel
-#allactiveMeasure can be added to the experiment class?
 
 def reset_scenarios(allSLR_Scenario,allSurgeHeight,allSurgeLevel):
     """
@@ -58,13 +62,14 @@ class Experiment():
     """
     
     def __init__(self,Model,SurgeLevel,Mayor,Implementation_time,name=None):
-        self.Model = deepcopy(Model)
-        self.SurgeLevel = deepcopy(SurgeLevel)
-        self.Mayor = deepcopy(Mayor)
+        self.Model = snapshot_Model(Model) #the scenario objects are not changed by a run, so they are not copied
+        self.SurgeLevel = SurgeLevel
+        self.Mayor = Mayor
         self.ImplementationTime = Implementation_time
         self.time = datetime.now() #moment at which the experiment was saved 
         if name is None: #If experiment is not provided with a name, make one!
-            self.name = "{}_{}_{}_{}".format(Model.name,SurgeLevel.name,Mayor.get_name(),str(Implementation_time))
+            name = "{}_{}_{}_{}".format(Model.name,SurgeLevel.name,Mayor.get_name(),str(Implementation_time))
+        self.name = name
     
     def __repr__(self):
         return self.name + " " + self.time.strftime("%Y/%m/%d, %H:%M:%S")
@@ -140,48 +145,473 @@ class Experiment():
 
         return df
     
+    def to_record(self):
+        "Compact, immutable version of this experiment (see ExperimentRecord)"
+        return ExperimentRecord.from_Model(self.Model,self.SurgeLevel,self.Mayor,self.ImplementationTime,name=self.name)
+    
+    
+def snapshot_Model(Model):
+    """
+    Cheap copy of a model after a run, to be stored in an Experiment
+    
+    init_time() creates new lists/arrays for all variables that change over time, so the next run
+    of the same Model does not change the results of this run. It is therefore sufficient to copy 
+    the Model, FloodProtection and ResidentialArea objects themselves (not their contents), 
+    instead of making a deepcopy of the whole model.
+    
+    Arguments:
+        *Model* (Model object) : model after running it
+    
+    Returns:
+        *snapshot* (Model object) : new model object referring to the results of this run
+    """
+    snapshot = copy.copy(Model)
+    snapshot.Parameters = dict(Model.Parameters)
+    snapshot.allFloodProtection = [copy.copy(FP) for FP in Model.allFloodProtection]
+    snapshot.allResidentialArea = [copy.copy(RA) for RA in Model.allResidentialArea]
+    return snapshot
+
+
+class RunContext():
+    """
+    All state that changes during one model run
+    
+    The run works on its own copy of the Model, FloodProtection and ResidentialArea objects 
+    (see snapshot_Model), so the Model that is passed (e.g. models.Rotty) is not changed by the run.
+    The measures that are planned but not yet implemented are tracked in self.activeMeasure, 
+    which is shared by the FloodProtection objects of this run (FloodProtection.activeMeasure);
+    each FloodProtection object also refers to its own planned measure (FloodProtection.measure_in_progress). 
+    The planned measures are kept in a priority queue on the timestep of implementation, so the 
+    run only has to act in the timesteps in which a measure is implemented (implement_measures). 
+    Runs in different threads therefore do not share any state.
+    
+    Arguments:
+        *Model* (Model object) : the model of the city to run
+    
+    Attributes:
+        *Model* (Model object) : the copy of the model that is changed during the run
+        *activeMeasure* (list) : measures that are planned but not yet implemented, in order of planning
+    """
+    def __init__(self,Model):
+        self.Model = snapshot_Model(Model)
+        self.activeMeasure = []
+        self._schedule = [] #heap of (timestep of implementation, order of planning, measure)
+        self._planned = 0 #number of measures planned
+        for FP in self.Model.allFloodProtection:
+            FP.activeMeasure = self.activeMeasure
+            FP.measure_in_progress = None
+            FP.run = self
+    
+    def schedule(self,measure):
+        "Add a measure that was just planned (Measure.plan_measure) to the schedule"
+        heapq.heappush(self._schedule,(measure.implementation_step,self._planned,measure))
+        self._planned += 1
+    
+    def implement_measures(self,i,end):
+        """
+        Implement the planned measures of which the lead time has passed in timestep i
+        
+        A measure with lead time L that is planned in timestep p is implemented in timestep p+L 
+        (after the mayor), measures that are implemented in the same timestep in order of planning.
+        Measures that were replaced by a larger measure (see mayors.propose_measure) are skipped.
+        
+        Arguments:
+            *i* (int) : index of timestep
+            *end* (int) : number of timesteps
+        """
+        while self._schedule and self._schedule[0][0] <= i:
+            implementation_step, _, measure = heapq.heappop(self._schedule)
+            if measure not in self.activeMeasure: #the measure was cancelled
+                continue
+            if implementation_step < i: #the measure was planned with a negative lead time
+                #This is a situation that occured in the model version 14/10/2020, if implementation times become to small
+                raise ValueError('Somehow the time_to_implementation became negative for measure {} in timestep {}'.format(measure,i))
+            measure.implement_measure(i,end)
+
+
+class ExperimentRecord():
+    """
+    Compact, immutable result of one experiment, alternative to the Experiment object
+    
+    Contains the variables that change over time as read-only NumPy arrays, and the names (keys)
+    of the model and scenarios instead of copies of the Model, SurgeLevel and Mayor objects. 
+    It is therefore cheap to create, to pickle and to send to other processes.
+    
+    Attributes:
+        *name* (string) : name of the experiment (same as Experiment.name)
+        *model* (string) : name of the model
+        *SLR_Scenario* (string) : name of the SLR scenario
+        *SurgeHeight* (string) : name of the (transient) SurgeHeight scenario
+        *mayor* (string) : name of the mayor
+        *ImplementationTime* (tuple) : implementation times of the measures
+        *years* (array) : years of the experiment
+        *series* (read-only dict) : variables over time, keys "{object name}_{variable}", e.g. "Area_B_risk"
+        *SurgeLevel* (SurgeLevel object) : reference to the scenario used, None after unpickling
+    """
+    __slots__ = ('name','model','SLR_Scenario','SurgeHeight','mayor','ImplementationTime','years','series','SurgeLevel')
+    
+    def __init__(self,name,model,SLR_Scenario,SurgeHeight,mayor,ImplementationTime,years,series,SurgeLevel=None):
+        values = {'name':name, 'model':model, 'SLR_Scenario':SLR_Scenario, 'SurgeHeight':SurgeHeight,
+                  'mayor':mayor, 'ImplementationTime':ImplementationTime,
+                  'years':self._frozen(years), 'SurgeLevel':SurgeLevel,
+                  'series':MappingProxyType({key: self._frozen(value) for key, value in series.items()})}
+        for attr, value in values.items():
+            object.__setattr__(self,attr,value)
+    
+    @staticmethod
+    def _frozen(values):
+        "Read-only NumPy array, only copied if it is not already read-only"
+        if isinstance(values,np.ndarray) and not values.flags.writeable:
+            return values
+        values = np.array(values)
+        values.flags.writeable = False
+        return values
+    
+    @classmethod
+    def from_Model(cls,Model,SurgeLevel,Mayor,Implementation_time,name=None):
+        """
+        Create a record from a model that was just run, without creating an Experiment
+        
+        Arguments:
+            *Model* (Model object) : model after running it
+            *SurgeLevel* (SurgeLevel object) : the storm surge scenario it was run with
+            *Mayor* (Mayor object) : the mayor it was run with
+            *Implementation_time* (tuple) : the implementation times it was run with
+            *name* (string) : name of the experiment, defaults to the same name as an Experiment
+        
+        Returns:
+            *record* (ExperimentRecord)
+        """
+        if name is None:
+            name = "{}_{}_{}_{}".format(Model.name,SurgeLevel.name,Mayor.get_name(),str(Implementation_time))
+        series = {}
+        for FP in Model.allFloodProtection:
+            for attr in FP.time_variables:
+                series["{}_{}".format(FP.name,attr)] = getattr(FP,attr)
+        for RA in Model.allResidentialArea:
+            for attr in RA.time_variables:
+                series["{}_{}".format(RA.name,attr)] = getattr(RA,attr)
+        return cls(name=name,model=Model.name,
+                   SLR_Scenario=SurgeLevel.corresponding_SLR_Scenario.name,
+                   SurgeHeight=SurgeLevel.corresponding_SurgeHeight.name,
+                   mayor=Mayor.get_name(),ImplementationTime=Implementation_time,
+                   years=SurgeLevel.years,series=series,SurgeLevel=SurgeLevel)
+    
+    def __setattr__(self,attr,value):
+        raise AttributeError("ExperimentRecord is immutable")
+    
+    def __reduce__(self): #the SurgeLevel is shared scenario data: it is not pickled, only its keys are
+        return (ExperimentRecord,(self.name,self.model,self.SLR_Scenario,self.SurgeHeight,self.mayor,
+                                  self.ImplementationTime,self.years,dict(self.series)))
+    
+    def __getitem__(self,key):
+        return self.series[key]
     
-def save_experiments(experiments,path=None):
+    def __repr__(self):
+        return "ExperimentRecord " + self.name
+    
+    def create_Metrics(self):
+        """
+        Output metrics of interest (the house prices), same as Experiment.create_Metrics()
+        
+        Returns:
+            *allMetrics* (list) : list of tipping.Metric objects
+        """
+        allMetrics = []
+        areas = [key[:-len("_house_price_t_objective")] for key in self.series if key.endswith("_house_price_t_objective")]
+        for name in areas:
+            allMetrics.append(tp.Metric(data=list(self.series["{}_house_price_t_objective".format(name)]),
+                                        index=list(self.years),name="{}_house_price_obj".format(name)))
+            allMetrics.append(tp.Metric(data=list(self.series["{}_house_price_t_subjective".format(name)]),
+                                        index=list(self.years),name="{}_house_price_subj".format(name)))
+        return allMetrics
+    
+    def to_df(self):
+        """
+        Export the key experiment variables to a pandas dataframe, same columns as Experiment.to_df()
+        (the 'surgelevel' column is only included if the SurgeLevel object is available)
+        
+        Returns:
+            *df* (Pandas DataFrame)
+        """
+        df = pd.DataFrame(index=self.years)
+        df['name'] = self.name
+        if self.SurgeLevel is not None:
+            df['surgelevel'] = self.SurgeLevel.surgelevel
+        
+        
+        FP_include = ['protection_level','measure_history']
+        RA_include = ['event_history','nearmiss_history','flood_damage','risk_household',
+                      'risk_household_perceived','risk_household_discounted','risk_household_discounted_perceived',
+                      'protection_level_rp','risk_perception','risk_perceived','house_price_t_subjective','house_price_t_objective']
+        for key, value in self.series.items():
+            if key.startswith('No_'): #ignore the no flood protection object
+                continue
+            if any(key.endswith("_" + attr) for attr in FP_include + RA_include):
+                df[key] = value
+        return df
+
+
+class ExperimentStore():
     """
-    Saves a list of experiments to a pickle, so it can be reused
+    Columnar store of experiment results on disk, to which experiments can be appended
+    
+    The store is a folder with one subfolder ('part') per call of append(). Each part contains:
+        *meta.npy* : the keys of the experiments (name, model, SLR_Scenario, SurgeHeight, mayor and
+                     implementation times), one row per experiment
+        *years.npy* : the years of the experiments in this part
+        *keys.npy* : the names of the variables, in the order of ExperimentRecord.series
+        *{variable}.npy* : one file per variable (e.g. 'Area_A_risk_perception'), with one row per 
+                           experiment and one column per year ('surgelevel' if the SurgeLevel was available)
+    A part is first written to its own temporary folder and then renamed, so the store never contains 
+    incomplete parts, and the existing parts are never changed. Experiments can therefore be appended 
+    from several threads or processes at the same time. The variables are read memory-mapped: 
+    only the experiments and variables that are used are read from the disk.
     
     Arguments:
-        *experiments* (list) : List containing Experiment objects
-        *path* (string) : Path to save pickle
+        *folder* (string/Path) : folder of the store, created if it does not exist
+    """
+    def __init__(self,folder):
+        self.folder = str(folder)
+        os.makedirs(self.folder,exist_ok=True)
+        self.refresh()
+    
+    def refresh(self):
+        "Read which parts are in the store (e.g. after another process appended experiments)"
+        parts = sorted(os.path.join(self.folder,name) for name in os.listdir(self.folder) 
+                       if name.startswith('part_') and os.path.isdir(os.path.join(self.folder,name)))
+        meta = [np.load(os.path.join(part,'meta.npy')) for part in parts]
+        years = [np.load(os.path.join(part,'years.npy'),mmap_mode='r') for part in parts]
+        keys = [[str(key) for key in np.load(os.path.join(part,'keys.npy'))] for part in parts]
+        #replace the state at once, so that other threads never see a mix of old and new parts
+        self.__dict__.update(parts=parts,_meta=meta,_years=years,_keys=keys,
+                             _offsets=np.cumsum([0] + [len(x) for x in meta]), #index of the first experiment of each part
+                             _columns={}, #(part number, variable) -> memory-mapped array
+                             _catalog=None) #ExperimentCatalog of the store, see select()
+    
+    def __len__(self):
+        return int(self._offsets[-1])
+    
+    def __repr__(self):
+        return "ExperimentStore {} ({} experiments in {} parts)".format(self.folder,len(self),len(self.parts))
+    
+    def append(self,experiments):
+        """
+        Add experiments to the store
+        
+        Arguments:
+            *experiments* (list) : Experiment or ExperimentRecord objects of the same model
+        
+        Returns:
+            *indices* (list of ints) : indices of the added experiments in the store 
+                                       (experiments appended by others at the same time may lie in between)
+        """
+        records = [exp.to_record() if isinstance(exp,Experiment) else exp for exp in experiments]
+        #Experiments with other years are written to a new part
+        written = [] #folders of the new parts
+        group = []
+        for record in records:
+            if group and not np.array_equal(record.years,group[0].years):
+                written.append(self._write_part(group))
+                group = []
+            group.append(record)
+        if group:
+            written.append(self._write_part(group))
+        self.refresh()
+        parts, offsets = self.parts, self._offsets
+        return [k for folder in written for k in range(offsets[parts.index(folder)],offsets[parts.index(folder)+1])]
+    
+    def _write_part(self,records):
+        "Write the records (with the same years) to a new part, returns the folder of the part"
+        keys = list(records[0].series.keys())
+        if any(list(record.series.keys()) != keys for record in records):
+            raise ValueError("All experiments in a part should have the same variables (same model)")
+        
+        string_field = lambda name, values : (name,'U{}'.format(max(1,max(len(x) for x in values))))
+        fields = ['name','model','SLR_Scenario','SurgeHeight','mayor']
+        dtype = [string_field(field,[getattr(record,field) for record in records]) for field in fields]
+        dtype += [('IT_small','<i8'),('IT_large','<i8')]
+        meta = np.array([tuple(getattr(record,field) for field in fields) + tuple(record.ImplementationTime) 
+                         for record in records],dtype=dtype)
+        
+        temp = tempfile.mkdtemp(prefix='temp_part_',dir=self.folder) #own folder for each writer
+        try:
+            np.save(os.path.join(temp,'meta.npy'),meta)
+            np.save(os.path.join(temp,'years.npy'),np.asarray(records[0].years))
+            if all(record.SurgeLevel is not None for record in records):
+                keys_saved = ['surgelevel'] + keys
+                np.save(os.path.join(temp,'surgelevel.npy'),np.array([record.SurgeLevel.surgelevel for record in records]))
+            else:
+                keys_saved = keys
+            np.save(os.path.join(temp,'keys.npy'),np.array(keys_saved))
+            for key in keys:
+                np.save(os.path.join(temp,key + '.npy'),np.stack([record.series[key] for record in records]))
+            
+            #Rename to the next free part number (fails if another writer added that part first)
+            number = len(self.parts)
+            while True:
+                folder = os.path.join(self.folder,'part_{:06d}'.format(number))
+                try:
+                    os.rename(temp,folder)
+                    return folder
+                except OSError:
+                    if not os.path.exists(folder):
+                        raise
+                    number += 1
+        except BaseException:
+            shutil.rmtree(temp,ignore_errors=True) #never leave an incomplete part behind
+            raise
+    
+    def _locate(self,k):
+        "Part number and row in the part of experiment k"
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("Experiment {} is not in the store ({} experiments)".format(k,len(self)))
+        part = int(np.searchsorted(self._offsets,k,side='right')) - 1
+        return part, k - int(self._offsets[part])
+    
+    def _column(self,part,key):
+        if (part,key) not in self._columns:
+            self._columns[(part,key)] = np.load(os.path.join(self.parts[part],key + '.npy'),mmap_mode='r')
+        return self._columns[(part,key)]
+    
+    def keys(self):
+        "Names of the variables in the store"
+        return self._keys[0] if self.parts else []
+    
+    def column(self,key):
+        """
+        One variable of all experiments
+        
+        Arguments:
+            *key* (string) : name of the variable, e.g. 'Area_A_house_price_t_objective'
+        
+        Returns:
+            *values* (array) : one row per experiment, one column per year 
+                               (memory-mapped if the store has one part, otherwise only this variable is loaded)
+        """
+        arrays = [self._column(part,key) for part in range(len(self.parts))]
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+    
+    def meta(self):
+        """
+        Returns:
+            *meta* (DataFrame) : the keys of all experiments (name, model, SLR_Scenario, SurgeHeight, 
+                                 mayor, IT_small, IT_large), one row per experiment
+        """
+        fields = ['name','model','SLR_Scenario','SurgeHeight','mayor','IT_small','IT_large']
+        return pd.DataFrame({field : self._field(field) for field in fields})
+    
+    def _field(self,field):
+        "One field of meta.npy of all experiments"
+        if not self.parts:
+            return np.zeros(0)
+        return np.concatenate([meta[field] for meta in self._meta])
+    
+    def record(self,k):
+        """
+        Experiment k, read from the disk
+        
+        Returns:
+            *record* (ExperimentRecord) : the variables refer to the memory-mapped files (no SurgeLevel object)
+        """
+        part, row = self._locate(k)
+        meta = self._meta[part][row]
+        series = {key : self._column(part,key)[row] for key in self._keys[part] if key != 'surgelevel'}
+        return ExperimentRecord(name=str(meta['name']),model=str(meta['model']),
+                                SLR_Scenario=str(meta['SLR_Scenario']),SurgeHeight=str(meta['SurgeHeight']),
+                                mayor=str(meta['mayor']),ImplementationTime=(int(meta['IT_small']),int(meta['IT_large'])),
+                                years=self._years[part],series=series)
+    
+    def __getitem__(self,k):
+        return self.record(k)
+    
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.record(k)
+    
+    def to_df(self,k):
+        """
+        Export the key variables of experiment k to a pandas dataframe, same columns as Experiment.to_df()
+        
+        Returns:
+            *df* (Pandas DataFrame)
+        """
+        df = self.record(k).to_df()
+        part, row = self._locate(k)
+        if 'surgelevel' in self._keys[part]:
+            df.insert(1,'surgelevel',self._column(part,'surgelevel')[row])
+        return df
+    
+    def select(self,SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=None):
+        """
+        Indices of the experiments that match the input values, see sel_exp() for the arguments
+        
+        Returns:
+            *indices* (list of ints) : the selected experiments
+        """
+        if self._catalog is None: #made at the first selection, after that only the index is used
+            self._catalog = ExperimentCatalog(self)
+        return self._catalog.select(SLR_scenarios,SurgeHeights,Mayors,ITs)
+
+
+def save_experiments(experiments,path=None,chunksize=1000):
     """
-    import pickle
-    from datetime import datetime
+    Saves a list of experiments to an ExperimentStore, so it can be reused
+    
+    If the store already exists, the experiments are added to it. The experiments are written 
+    in chunks, so the list can also be a generator that runs the experiments one by one.
     
+    Arguments:
+        *experiments* (list) : List containing Experiment (or ExperimentRecord) objects
+        *path* (string) : Folder of the store
+        *chunksize* (int) : Number of experiments written at once (one part of the store)
+    
+    Returns:
+        *store* (ExperimentStore) : the store the experiments were saved in
+    """
     #save in a default folder
     if not path:
-        foldername = "temp"
-        subfolder = "experiments"
-        target = os.path.join(foldername,subfolder)
-        
         today = datetime.date(datetime.now())
         date = "{}_{}_{}".format(today.year,today.month,today.day)
-        
-        if not os.path.exists(foldername):
-            os.mkdir(foldername)
-            if not os.path.exists(target):
-                os.mkdir(target)
-        path = os.path.join(target,"experiment_" + date + ".p")
+        path = os.path.join("temp","experiments","experiment_" + date)
+    
+    store = ExperimentStore(path)
+    if len(store) > 0:
+        print('The destination {} already contains {} experiments, the experiments are added to it'.format(path,len(store)))
+    chunk = []
+    for experiment in experiments:
+        chunk.append(experiment.to_record() if isinstance(experiment,Experiment) else experiment)
+        if len(chunk) == chunksize:
+            store.append(chunk)
+            chunk = []
+    if chunk:
+        store.append(chunk)
+    print("Experiments saved at: {}".format(path))
+    return store
+
+def load_experiments(path):
+    """
+    Load experiments saved with save_experiments()
     
-    if os.path.exists(path):
-        print('The destination file {} already exists!'.format(path))
-        cont = input('Do you want to overwrite it? If so, type "y"\n If you type something else, it wont save.')
-        if cont != 'y':
-            return print("File not saved")
+    Arguments:
+        *path* (string) : Folder of an ExperimentStore, or a pickle with a list of experiments (older versions)
     
-    pickle.dump(experiments, open( os.path.join(path), "wb") ) 
-    return print("File saved at: {}".format(path))
+    Returns:
+        *experiments* (ExperimentStore or list of Experiment objects)
+    """
+    if os.path.isdir(path):
+        return ExperimentStore(path)
+    with open(path,'rb') as f:
+        return pickle.load(f)
 
 def sel_exp(experiments,SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=None):
     """
     Filter a list of experiments, based on the inputs values
     
     Arguments:
-        *experiments* (list of experiment objects) : The input experiments
+        *experiments* (list of experiment objects) : The input experiments (or an ExperimentStore or ExperimentCatalog)
         *SLR_scenario* (str/list of strs) : Number referring to the SLR scenario
         *SurgeHeight* (int or string / list of ints/strings) : Number referring to the transient storm surge height scenario
         *Mayor* (str/list of strs) : Name of the mayor(s)
@@ -192,38 +622,157 @@ def sel_exp(experiments,SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=
         if you put any of the above to 'All', this variable will not be filtered
     
     Returns:
-        *selection* (list of experiment objects) : The selected experiments
+        *selection* (list of experiment objects) : The selected experiments (ExperimentRecords for a store)
+        
+    For many queries on the same (large) list of experiments, make an ExperimentCatalog of the list once.
 
     Example syntax:
     selection = sel_exp(experiments,SLR_scenarios='01',SurgeHeights='five_hundred_0',Mayors='Lawkeeper',ITs=[(4,6),(11,16)])
     """
-    selection = experiments
+    if isinstance(experiments,ExperimentCatalog):
+        return experiments.sel_exp(SLR_scenarios,SurgeHeights,Mayors,ITs)
+    if isinstance(experiments,ExperimentStore): #only read the selected experiments from the disk
+        return [experiments.record(k) for k in experiments.select(SLR_scenarios,SurgeHeights,Mayors,ITs)]
     
+    criteria = selection_criteria(SLR_scenarios,SurgeHeights,Mayors,ITs)
+    selection = experiments
+    for dimension, values in criteria.items():
+        selection = [exp for exp in selection if experiment_keys(exp)[dimension] in values]
+    return selection
+
+def selection_criteria(SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=None):
+    """
+    The values to select on, for each dimension that is filtered (see sel_exp() for the arguments)
     
+    Returns:
+        *criteria* (dict) : keys 'SLR_Scenario', 'SurgeHeight', 'mayor', 'ImplementationTime' (only those 
+                            that are filtered), values (list) the names / implementation times to select
+    """
+    criteria = {}
     if not SLR_scenarios == 'All':
         if isinstance(SLR_scenarios,str):
             SLR_scenarios = [SLR_scenarios] #put the value in a list
-        SLR_scenarios = ['Scenario_' + name for name in SLR_scenarios]
-        selection = [exp for exp in experiments if exp.SurgeLevel.corresponding_SLR_Scenario.name in SLR_scenarios]
+        criteria['SLR_Scenario'] = ['Scenario_' + name for name in SLR_scenarios]
     
     if not SurgeHeights == 'All':
         if not isinstance(SurgeHeights,list):
             SurgeHeights = [SurgeHeights]
-        SurgeHeights = [str(x) for x in SurgeHeights] #make them strings if they were ints
-        selection = [exp for exp in selection if exp.SurgeLevel.corresponding_SurgeHeight.name in SurgeHeights]
+        criteria['SurgeHeight'] = [str(x) for x in SurgeHeights] #make them strings if they were ints
     
     if not Mayors == 'All':
         if not isinstance(Mayors,list):
             Mayors = [Mayors]
-        selection = [exp for exp in selection if exp.Mayor.get_name() in Mayors]
+        criteria['mayor'] = Mayors
+    
+    if ITs is not None and not ITs == 'All':
+        if not isinstance(ITs,list):
+            ITs = [ITs]
+        criteria['ImplementationTime'] = [tuple(IT) for IT in ITs]
+    return criteria
 
-    if ITs is not None:
-        if not ITs == 'All':
-            if not isinstance(ITs,list):
-                ITs = [ITs]
-        selection = [exp for exp in selection if exp.ImplementationTime in ITs]
+def experiment_keys(exp):
+    """
+    The values sel_exp() selects on, for an Experiment or ExperimentRecord
+    (or other objects with the same attributes as an ExperimentRecord, e.g. workbench_version.ExperimentHandle)
+    
+    Returns:
+        *keys* (dict) : keys 'SLR_Scenario', 'SurgeHeight', 'mayor', 'ImplementationTime'
+    """
+    if hasattr(exp,'SLR_Scenario'):
+        return {'SLR_Scenario' : exp.SLR_Scenario, 'SurgeHeight' : exp.SurgeHeight, 'mayor' : exp.mayor, 
+                'ImplementationTime' : tuple(exp.ImplementationTime)}
+    IT = getattr(exp,'ImplementationTime',None) #experiments from before 19/1/2021 do not have it
+    return {'SLR_Scenario' : exp.SurgeLevel.corresponding_SLR_Scenario.name, 
+            'SurgeHeight' : exp.SurgeLevel.corresponding_SurgeHeight.name, 
+            'mayor' : exp.Mayor.get_name(), 
+            'ImplementationTime' : tuple(IT) if IT is not None else None}
 
-    return selection
+
+class ExperimentCatalog():
+    """
+    Index of a (large) list of experiments, for fast repeated selections (see sel_exp)
+    
+    For each dimension (SLR scenario, SurgeHeight, mayor and implementation time) the catalog 
+    stores the category of each experiment as an integer code. For each category that is asked for,
+    a bitmap (one bit per experiment, packed in bytes) of the experiments in that category is made 
+    once and kept (an inverted index). A query combines the bitmaps of the requested categories 
+    (OR within a dimension, AND between dimensions), without looking at the experiments themselves.
+    
+    Arguments:
+        *experiments* (list/ExperimentStore) : Experiment or ExperimentRecord objects, or a store
+    
+    Attributes:
+        *experiments* : the experiments of the catalog
+        *categories* (dict) : for each dimension the list of categories, in order of first appearance
+    """
+    dimensions = ['SLR_Scenario','SurgeHeight','mayor','ImplementationTime']
+    
+    def __init__(self,experiments):
+        self.experiments = experiments
+        if isinstance(experiments,ExperimentStore):
+            values = {dimension : experiments._field(dimension).tolist() for dimension in self.dimensions[:3]}
+            values['ImplementationTime'] = list(zip(experiments._field('IT_small').tolist(),experiments._field('IT_large').tolist()))
+        else:
+            keys = [experiment_keys(exp) for exp in experiments]
+            values = {dimension : [key[dimension] for key in keys] for dimension in self.dimensions}
+        self.n = len(experiments)
+        self.categories = {}
+        self._codes = {} #dimension -> array with the code of the category of each experiment
+        self._lookup = {} #dimension -> {category : code}
+        for dimension in self.dimensions:
+            lookup = {}
+            codes = np.array([lookup.setdefault(value,len(lookup)) for value in values[dimension]],dtype=np.int64)
+            self._codes[dimension] = codes
+            self._lookup[dimension] = lookup
+            self.categories[dimension] = list(lookup)
+        self._bitmaps = {} #(dimension, code) -> packed bitmap
+    
+    def __len__(self):
+        return self.n
+    
+    def __repr__(self):
+        return "ExperimentCatalog of {} experiments".format(self.n)
+    
+    def bitmap(self,dimension,category):
+        """
+        Returns:
+            *bitmap* (array of uint8) : packed bits, bit k is set if experiment k is in the category
+        """
+        code = self._lookup[dimension].get(category)
+        if code is None: #no experiments in this category
+            return np.zeros((self.n + 7) // 8,dtype=np.uint8)
+        if (dimension,code) not in self._bitmaps:
+            self._bitmaps[(dimension,code)] = np.packbits(self._codes[dimension] == code)
+        return self._bitmaps[(dimension,code)]
+    
+    def select(self,SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=None):
+        """
+        Indices of the experiments that match the input values, see sel_exp() for the arguments
+        
+        Returns:
+            *indices* (list of ints) : the selected experiments, in the order of the catalog
+        """
+        selected = None
+        for dimension, values in selection_criteria(SLR_scenarios,SurgeHeights,Mayors,ITs).items():
+            bitmap = np.zeros((self.n + 7) // 8,dtype=np.uint8)
+            for value in values:
+                bitmap |= self.bitmap(dimension,value)
+            selected = bitmap if selected is None else selected & bitmap
+        if selected is None: #nothing is filtered
+            return list(range(self.n))
+        return np.flatnonzero(np.unpackbits(selected,count=self.n)).tolist()
+    
+    def sel_exp(self,SLR_scenarios='All',SurgeHeights='All',Mayors='All',ITs=None):
+        """
+        Same as sel_exp(), but using the index
+        
+        Returns:
+            *selection* (list of experiment objects) : the selected experiments
+        """
+        indices = self.select(SLR_scenarios,SurgeHeights,Mayors,ITs)
+        if isinstance(self.experiments,ExperimentStore):
+            return [self.experiments.record(k) for k in indices]
+        return [self.experiments[k] for k in indices]
 
 
 
@@ -246,6 +795,7 @@ class Model():
         self.allFloodProtection = [] #List with all the flood protection objects relevant for the city (need to be connected with Residential Areas)
         self.allResidentialArea = [] #list with all the residential areas in the city 
         self.Parameters = {} #Dict containing all model parameters
+        self._Gumbel_tables = {} #GumbelTable objects, see Gumbel_table()
         
     def add_FloodProtection(self,FloodProtection): #Add flood protection object to model
         self.allFloodProtection.append(FloodProtection)
@@ -255,6 +805,29 @@ class Model():
         
     def add_Parameter(self,parameter_name,parameter_value): #Add parameter to the model
         self.Parameters[parameter_name] = parameter_value
+        if parameter_name == "Gumbel": #the return levels of the old distribution are no longer valid
+            self._Gumbel_tables = {}
+    
+    def Gumbel_table(self,RPs):
+        """
+        The return levels of the storm surge height for a list of return periods, using the Gumbel 
+        parameters of the model. These only depend on Parameters["Gumbel"], so they are calculated 
+        once and shared by all timesteps and experiments that use this model.
+        
+        Arguments:
+            *RPs* (list of ints/floats) : return periods [years]
+        
+        Returns:
+            *table* (GumbelTable)
+        """
+        if not hasattr(self,'_Gumbel_tables'): #to guarantee backward compatability with pickled models
+            self._Gumbel_tables = {}
+        mu = self.Parameters["Gumbel"]["mu"]
+        beta = self.Parameters["Gumbel"]["beta"]
+        key = (tuple(RPs),mu,beta) #also check the values, in case Parameters["Gumbel"] was changed in place
+        if key not in self._Gumbel_tables:
+            self._Gumbel_tables[key] = GumbelTable(RPs,mu,beta)
+        return self._Gumbel_tables[key]
     
     def __repr__(self):
         name = self.name
@@ -320,6 +893,19 @@ class SLR_Scenario:
 
         self.years = [int(i) for i in years]
         self.sealevel = [float(i) for i in sealevel] #convert strings to floats
+    
+    def from_bundle(self,bundle,name=None):
+        """Add data from a series in a ScenarioBundle (see pack_scenarios)
+        
+        Arguments:
+            *bundle* (ScenarioBundle) : the bundle
+            *name* (string) : name of the series, defaults to self.name
+        """
+        if name is None:
+            name = self.name
+        self.years = bundle.series(name)[0].tolist()
+        self.sealevel = bundle.values_as_list(name)
+        self.description = bundle.description(name)
         
     def plot(self):
         df = pd.DataFrame(self.sealevel,index=self.years)
@@ -380,8 +966,9 @@ class SurgeHeight:
     NOTE: SurgeLevel = SLR_Scenario + SurgeHeight
     
     """
-    def __init__(self,name):
-        allSurgeHeight.append(self)
+    def __init__(self,name,register=True):
+        if register: #register=False: not kept in allSurgeHeight (e.g. for objects in a cache)
+            allSurgeHeight.append(self)
         self.name = name  
         
     def from_Gumbel(self,startyear,endyear,mu,beta,csv_path=False):
@@ -426,6 +1013,18 @@ class SurgeHeight:
 
         self.years = [int(i) for i in years]
         self.surgeheight = [float(i) for i in surgelevel] #convert strings to floats
+    
+    def from_bundle(self,bundle,name=None):
+        """Get the Surge Height from a series in a ScenarioBundle (see pack_scenarios)
+        
+        Arguments:
+            *bundle* (ScenarioBundle) : the bundle
+            *name* (string) : name of the series, defaults to self.name
+        """
+        if name is None:
+            name = self.name
+        self.years = bundle.series(name)[0].tolist()
+        self.surgeheight = bundle.values_as_list(name)
 
     def __repr__(self):
         if hasattr(self,'years') and hasattr(self,'surgeheight'):
@@ -445,9 +1044,10 @@ class SurgeLevel:
     
     NOTE: SurgeLevel = SLR_Scenario + SurgeHeight
     """ 
-    def __init__(self,name=None):
+    def __init__(self,name=None,register=True):
         self.name = name
-        allSurgeLevel.append(self) #Add to the overview of all flood protection objects
+        if register: #register=False: not kept in allSurgeLevel (e.g. for objects in a cache)
+            allSurgeLevel.append(self) #Add to the overview of all flood protection objects
     
     def from_combination(self,SLR_Scenario,SurgeHeight):
         """
@@ -472,9 +1072,9 @@ class SurgeLevel:
     def __str__(self): #this is what you see if you say "print(object)" meant to be simple
         return self.name
     
-def combine_SurgeLevel(SLR_Scenario,SurgeHeight):
+def combine_SurgeLevel(SLR_Scenario,SurgeHeight,register=True):
     name = SLR_Scenario.name + "__" + SurgeHeight.name
-    instance = SurgeLevel(name=name) #Create new instance of object
+    instance = SurgeLevel(name=name,register=register) #Create new instance of object
     instance.from_combination(SLR_Scenario,SurgeHeight) #derive data from combining both sources
     return instance
 
@@ -513,6 +1113,158 @@ def combine_SurgeLevel(SLR_Scenario,SurgeHeight):
     
 #     return SurgeLevel
     
+################################ SCENARIO BUNDLES ########################################
+
+bundle_filename = "scenario_bundle.npy" #default name of the bundle in a scenario folder
+
+def pack_scenarios(folder,target=None):
+    """
+    Pack all scenarios in a folder into one binary file (a 'bundle') that can be memory-mapped,
+    so that the scenarios can be loaded without parsing csv files or unpickling objects
+    
+    The bundle is a NumPy structured array with one row per series, and the fields:
+        *name* : name of the series (the file name without extension for csv files, 
+                 and SLR_Scenario.name for pickles)
+        *years* : the years (int)
+        *values* : surge height or sea level per year (float)
+        *length* : number of years of the series (shorter series are padded with NaN)
+        *description* : description of the SLR_Scenario ('' for csv files)
+        *numpy_float* : if the values were NumPy floats instead of Python floats (this differs
+                        between the pickled SLR_Scenarios, and is kept to reproduce them exactly)
+    
+    Arguments:
+        *folder* (string/Path) : folder with SurgeHeight csv files (2 columns: year, value) 
+                                 and/or SLR_Scenario pickles (.pkl)
+        *target* (string/Path) : path to save the bundle, defaults to folder/scenario_bundle.npy
+    
+    Returns:
+        *target* (string/Path) : path to the saved bundle
+        
+    NOTE: the bundle needs to be packed again after any of the scenarios in the folder have changed
+    """
+    if target is None:
+        target = os.path.join(folder,bundle_filename)
+    
+    names, years, values, descriptions, numpy_floats = [], [], [], [], []
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder,filename)
+        if filename.endswith(".csv"):
+            SH = SurgeHeight(os.path.splitext(filename)[0],register=False) #only used to read the csv
+            SH.from_csv(path)
+            names.append(SH.name)
+            years.append(SH.years)
+            values.append(SH.surgeheight)
+            descriptions.append('')
+            numpy_floats.append(False)
+        elif filename.endswith(".pkl"):
+            with open(path,'rb') as f:
+                SLR = pickle.load(f)
+            names.append(SLR.name)
+            years.append(SLR.years)
+            values.append(SLR.sealevel)
+            descriptions.append(str(SLR.description) if SLR.description is not None else '')
+            numpy_floats.append(isinstance(SLR.sealevel[0],np.floating))
+    if len(names) == 0:
+        raise ValueError("No csv or pkl files found in {}".format(folder))
+    
+    n = max(len(x) for x in years)
+    dtype = [('name','U{}'.format(max(len(x) for x in names))),
+             ('years','<i8',(n,)),
+             ('values','<f8',(n,)),
+             ('length','<i8'),
+             ('description','U{}'.format(max(1,max(len(x) for x in descriptions)))),
+             ('numpy_float','?')]
+    bundle = np.zeros(len(names),dtype=dtype)
+    bundle['values'] = np.nan
+    for row, (name,y,v,description,numpy_float) in enumerate(zip(names,years,values,descriptions,numpy_floats)):
+        bundle[row]['name'] = name
+        bundle[row]['years'][:len(y)] = y
+        bundle[row]['values'][:len(v)] = v
+        bundle[row]['length'] = len(y)
+        bundle[row]['description'] = description
+        bundle[row]['numpy_float'] = numpy_float
+    np.save(target,bundle)
+    return target
+
+
+class ScenarioBundle():
+    """
+    Read access to a bundle created by pack_scenarios()
+    
+    The file is memory-mapped, so only the series that are used are read from disk,
+    and a series is found by its name in constant time.
+    
+    Arguments:
+        *path* (string/Path) : path to the bundle (.npy)
+    """
+    def __init__(self,path):
+        self.path = path
+        self.data = np.load(path,mmap_mode='r')
+        self.index = {name : row for row, name in enumerate(self.data['name'])} #name -> row
+    
+    @property
+    def names(self):
+        return list(self.index)
+    
+    def __contains__(self,name):
+        return name in self.index
+    
+    def __len__(self):
+        return len(self.index)
+    
+    def series(self,name):
+        """
+        Arguments:
+            *name* (string) : name of the series
+        
+        Returns:
+            *years* (read-only array of ints)
+            *values* (read-only array of floats)
+        """
+        row = self.data[self.index[name]]
+        n = row['length']
+        return row['years'][:n], row['values'][:n]
+    
+    def values_as_list(self,name):
+        "The values of a series as a list of floats, of the same type (Python/NumPy) as the packed series"
+        values = self.series(name)[1]
+        if self.data[self.index[name]]['numpy_float']:
+            return list(values)
+        return values.tolist()
+    
+    def description(self,name):
+        description = str(self.data[self.index[name]]['description'])
+        return description if description != '' else None
+    
+    def SurgeHeight(self,name,register=True):
+        "Create a SurgeHeight object from a series in the bundle (register: add it to allSurgeHeight)"
+        SH = SurgeHeight(name,register)
+        SH.from_bundle(self,name)
+        return SH
+    
+    def SLR_Scenario(self,name):
+        "Create a SLR_Scenario object from a series in the bundle"
+        SLR = SLR_Scenario(name)
+        SLR.from_bundle(self,name)
+        return SLR
+    
+    def __repr__(self):
+        return "ScenarioBundle {} ({} series)".format(self.path,len(self))
+        
+def SLR_Scenario_from_bundle(path):
+    """
+    Load all SLR_Scenarios from a bundle, same as SLR_Scenario_from_pickles()
+    
+    Arguments:
+        *path* (string/Path) : path to the bundle, created with pack_scenarios() from a folder with pickles
+    
+    Returns:
+        *allSLR_Scenario* (list of SLR_Scenario objects)
+    """
+    bundle = ScenarioBundle(path)
+    return [bundle.SLR_Scenario(name) for name in bundle.names]
+    
+
 ################################ FLOOD PROTECTION OBJECTS ########################################       
 
 class FloodProtection:
@@ -526,10 +1278,18 @@ class FloodProtection:
         self.name = name #Name of the flood protection object (string)
         self.baseline_level = baseline_level #initial level of flood protection
         self.description = description
-        self.activeMeasure = [] #initially, there are no active measures for the FP object
+        self.activeMeasure = [] #initially, there are no active measures for the FP object (shared with the other FP objects during a run, see RunContext)
+        self.measure_in_progress = None #the measure that is planned for this FP object, but not yet implemented
+        self.run = None #the RunContext of the run this FP object is part of
+    
+    time_variables = ['protection_level','measure_history'] #variables created by init_time
         
-    def init_time(self,time): #If the model is run over time, initialise lists to store the results for the variables of interest
-        self.protection_level = [self.baseline_level] * len(time) #store the development of flood protection over time
+    def init_time(self,time,as_array=False): #If the model is run over time, initialise lists to store the results for the variables of interest
+        #store the development of flood protection over time (always an array: measures change it in place, see Measure_FloodProtection)
+        self.protection_level = np.full(len(time),self.baseline_level,dtype=float)
+        if as_array: #store the time series as NumPy arrays instead of lists (used by run_model02)
+            self.measure_history = np.zeros(len(time))
+            return
         self.measure_history = [0] * len(time) #store in which timestep which measures were taken
         
     def reset_protection_level(self):
@@ -561,7 +1321,15 @@ class ResidentialArea():
         self.protected_by = protected_by #Names of the FloodProtection objects it is protected by
         self.description = description
     
-    def init_time(self,time,risk_perception_0=0): #If the model is run over time, initialise lists to store the results for the variables of interest
+    #variables created by init_time (in order of creation)
+    time_variables = ['event_history','flood_history','nearmiss_history','flood_damage','risk','risk_household',
+                      'risk_household_perceived','risk_household_discounted','risk_household_discounted_perceived',
+                      'protection_level_rp','risk_perception','risk_perceived',
+                      'house_price_t_subjective','house_price_t_objective','flood_proofing']
+    
+    def init_time(self,time,risk_perception_0=0,as_array=False): #If the model is run over time, initialise lists to store the results for the variables of interest
+        if as_array: #store the time series as NumPy arrays instead of lists (used by run_model02)
+            return self._init_time_array(time,risk_perception_0)
         self.event_history = [""] * len(time) #"": nothing happens, "~" flood, "!" : near miss
         self.flood_history = [float("NaN")] * len(time) #SAVE THE INUNDATION DEPTHS [m]
         self.nearmiss_history = [float("NaN")] * len(time) #SAVE THE DIFFERENCE BETWEEN THE DIKE HEIGHT AND PROTECTION LEVEL IN CASE OF NEAR MISS [0, 0.5]
@@ -583,6 +1351,20 @@ class ResidentialArea():
         
         #Implemented on 20 August:
         self.flood_proofing = [False] * len(time) #Boolean indicating if flood proofing was implemented
+    
+    def _init_time_array(self,time,risk_perception_0=0):
+        """
+        Same as init_time, but stores all variables that change over time as NumPy arrays
+        The content of the arrays equals that of the lists created by init_time
+        """
+        n = len(time)
+        self.event_history = np.full(n,"",dtype="<U1") #"": nothing happens, "~" flood, "!" : near miss
+        for attr in self.time_variables[1:-1]:
+            setattr(self,attr,np.full(n,np.nan))
+        self.risk_perception[0] = risk_perception_0
+        self.house_price_t_subjective[0] = self.house_price_0 # Set the first timestep
+        self.house_price_t_objective[0] = self.house_price_0 # Set the first timestep
+        self.flood_proofing = np.zeros(n,dtype=bool) #Boolean indicating if flood proofing was implemented
         
     def match_with_FloodProtection(self,allFloodProtection): #TODO Make sure that it does not add it two times!
         for i in allFloodProtection: #Iterate over all possible FloodProtections 
@@ -655,6 +1437,11 @@ class ResidentialArea():
         return damage
       
         
+    @property
+    def damage_function(self):
+        "The DamageFunction for the damage curves of this area (shared with all areas that use the same curves)"
+        return get_DamageFunction(self.dam_pars,self.dam_pars_household)
+    
     def weigh_RP_Bayesian(self,time,I_exp_interp,I_social):
         """"
         Apply Bayesian learning to the Risk Perception
@@ -708,6 +1495,85 @@ class ResidentialArea():
     def __str__(self): #this is what you see if you say "print(object)"
         return self.__dict__
 
+class DamageFunction():
+    """
+    The depth-damage functions for a residential area and for a household, evaluated for whole arrays of 
+    inundation depths at once. Gives the same results as ResidentialArea.calculate_damage and 
+    calculate_damage_household for each element.
+    
+    The damage curves don't depend on the area (only the surface area does), so one instance can serve 
+    all areas of a city, use get_DamageFunction() to obtain it.
+    
+    Arguments:
+        *dam_pars* (tuple) : (MaxDamage_Residential,depth,dam_frac) for the area, MaxDamage in euro/m2
+        *dam_pars_household* (tuple) : (MaxDamage_household,depth,dam_frac) for one household, MaxDamage in euro
+    """
+    def __init__(self,dam_pars,dam_pars_household):
+        self.max_damage = dam_pars[0] #euro/m2
+        self.max_damage_household = dam_pars_household[0] #euro/house
+        self.depth = np.array(dam_pars[1],dtype=float)
+        self.dam_frac = np.array(dam_pars[2],dtype=float)
+        self.depth_household = np.array(dam_pars_household[1],dtype=float)
+        self.dam_frac_household = np.array(dam_pars_household[2],dtype=float)
+        #if both curves have the same shape, the damage fraction only needs to be interpolated once
+        self.same_curve = (np.array_equal(self.depth,self.depth_household) and 
+                           np.array_equal(self.dam_frac,self.dam_frac_household))
+    
+    def calculate(self,inundation,surface_area,flood_proofing=False):
+        """
+        Calculate the flood damage for the area and for one household
+        
+        Arguments:
+            *inundation* (array) : Inundation depths in m
+            *surface_area* (float) : Surface area of the region in km2
+            *flood_proofing* (array of bools) : if flood proofing was implemented, broadcastable to inundation
+        
+        Returns:
+            *damage* (array) : damage to the area in 2010-Euros
+            *damage_household* (array) : damage to a household in 2010-Euros
+        """
+        inundation = np.asarray(inundation,dtype=float)
+        dam_fraction = np.interp(inundation,self.depth,self.dam_frac) #fraction of max damage
+        if self.same_curve:
+            dam_fraction_household = dam_fraction
+        else:
+            dam_fraction_household = np.interp(inundation,self.depth_household,self.dam_frac_household)
+        damage = np.round(self.max_damage * 10**6 * surface_area * dam_fraction)
+        damage_household = np.round(self.max_damage_household * dam_fraction_household)
+        
+        #Flood proofing procedure of Haer et al., (2017): 70% reduction of damage if water depth < 1 m
+        proofed = np.logical_and(flood_proofing,inundation < 1)
+        if np.any(proofed):
+            damage = np.where(proofed,damage * 0.3,damage)
+            damage_household = np.where(proofed,damage_household * 0.3,damage_household)
+        return damage, damage_household
+    
+    def calculate_area(self,inundation,surface_area,flood_proofing=False):
+        "Only the damage to the area, see calculate()"
+        inundation = np.asarray(inundation,dtype=float)
+        dam_fraction = np.interp(inundation,self.depth,self.dam_frac) #fraction of max damage
+        damage = np.round(self.max_damage * 10**6 * surface_area * dam_fraction)
+        return np.where(np.logical_and(flood_proofing,inundation < 1),damage * 0.3,damage)
+    
+    def __repr__(self):
+        return "DamageFunction: max damage {} euro/m2, {} euro/household".format(self.max_damage,self.max_damage_household)
+
+#The DamageFunction objects that were created, see get_DamageFunction()
+allDamageFunction = {}
+
+def get_DamageFunction(dam_pars,dam_pars_household):
+    """
+    Get the DamageFunction for a combination of damage parameters, creating it only the first time
+    
+    Arguments:
+        *dam_pars* (tuple) : (MaxDamage_Residential,depth,dam_frac) for the area
+        *dam_pars_household* (tuple) : (MaxDamage_household,depth,dam_frac) for one household
+    """
+    key = tuple((pars[0],tuple(pars[1]),tuple(pars[2])) for pars in (dam_pars,dam_pars_household))
+    if key not in allDamageFunction:
+        allDamageFunction[key] = DamageFunction(dam_pars,dam_pars_household)
+    return allDamageFunction[key]
+
 def discount_risk(EAD,discount=0.03,horizon=80):
     """
     Calculated discounted flood risk for a time series of expected annual damage
@@ -724,14 +1590,54 @@ def discount_risk(EAD,discount=0.03,horizon=80):
     if horizon > len(EAD): #the requested horizon is longer than the available EADs
         raise ValueError("The requested time horizon {} is longer than amount of available EADs {}".format(horizon,len(EAD)))
     
-    selected_EAD = EAD[0:horizon]
-    timesteps = list(range(0,horizon))
-    df_t = [1 / (1+discount)**t for t in timesteps] #calculate discount factor per timestep
-    npvs = [None] * len(timesteps)
-    for t in range(len(timesteps)):
-        npvs[t] = EAD[t] * df_t[t]
+    df_t = discount_factors(discount,horizon) #discount factor per timestep
+    return sum([EAD[t] * df_t[t] for t in range(horizon)])
+
+@lru_cache(maxsize=None)
+def discount_factors(discount=0.03,horizon=80):
+    """
+    The discount factor per timestep, 1 / (1+discount)**t for t in [0, horizon) 
+    These only depend on the discount rate and horizon, so they are calculated once and cached
+    
+    Returns:
+        *df_t* (tuple of floats)
+    """
+    return tuple(1 / (1+discount)**t for t in range(0,horizon))
+
+def discount_constant_risk(EAD,discount=0.03,horizon=80):
+    """
+    Discounted flood risk if the EAD stays constant over the horizon
+    Gives the same result as discount_risk([EAD] * horizon,discount,horizon), without creating the list
+    
+    Arguments:
+        *EAD* (float) : the EAD in each year of the horizon
+        *discount* (float) : discount factor per year
+        *horizon* (int) : time horizon to discount over
+    
+    Returns:
+        *Risk_discounted* (float) : discounted risk in t=0
+    """
+    return sum([EAD * df for df in discount_factors(discount,horizon)])
+
+def discount_risk_array(EAD,discount=0.03,horizon=80):
+    """
+    Array version of discount_constant_risk: discounts a whole time series of EADs in one call,
+    each of them assumed constant over the horizon. Gives the same results as discount_constant_risk 
+    for each element (the terms are summed in the same order).
+    
+    Arguments:
+        *EAD* (array) : the EAD in each timestep (any shape)
+        *discount* (float) : discount factor per year
+        *horizon* (int) : time horizon to discount over
     
-    return sum(npvs)
+    Returns:
+        *Risk_discounted* (array) : discounted risk for each element of EAD
+    """
+    EAD = np.asarray(EAD,dtype=float)
+    total = np.zeros(EAD.shape)
+    for df in discount_factors(discount,horizon):
+        total = total + EAD * df
+    return total
 
 
 class Bayesian_pars():
@@ -762,38 +1668,48 @@ class Bayesian_pars():
     
 ################################ MEASURE CLASS (CAN BE TAKEN BY MAYORS) ########################################  
 
-def allactiveMeasure_reset():
-    allactiveMeasure = []
-    
 class Measure():
     def __init__(self,name,lead_time):
         self.name = name
         self.lead_time = lead_time #time it takes to implement the measure     
 
     def plan_measure(self,apply_to,i):
-        """ self.time_to_implementation is a counter, 
-        which counts how many years remain before measure is active"""
+        """
+        Plan the measure in timestep i: it is implemented lead_time years later (see RunContext.implement_measures)
         
+        Arguments:
+            *apply_to* (FloodProtection object) : flood protection object to which measure should be applied
+            *i* (int) : index of timestep
+        """
+        if apply_to.run is None:
+            raise ValueError('FloodProtection {} is not part of a run, so measures can not be planned: use the Model of a RunContext'.format(apply_to.name))
         self.apply_to = apply_to #flood protection object to which measure should be applied
-        self.time_to_implementation = self.lead_time
-        allactiveMeasure.append(self)
+        self.planned_step = i #timestep in which the measure was planned
+        self.implementation_step = i + self.lead_time #timestep in which the measure will be implemented
+        apply_to.activeMeasure.append(self) #the active measures of the run the flood protection belongs to
+        apply_to.measure_in_progress = self
+        apply_to.run.schedule(self)
         apply_to.measure_history[i] = self.heightening #can be made nicer
+    
+    def time_to_implementation(self,i):
+        "Number of years before the measure is implemented, as seen in timestep i"
+        return self.implementation_step - i
+    
+    def cancel(self):
+        "Stop working on the measure (it will not be implemented)"
+        self.apply_to.activeMeasure.remove(self) #remove the measure from the active measure list
+        if self.apply_to.measure_in_progress is self:
+            self.apply_to.measure_in_progress = None
         
-    def countdown(self,i,end):#counts down, and if counter = 0 implements the measure
-        if self.time_to_implementation > 0:
-            self.time_to_implementation = self.time_to_implementation - 1
-        elif self.time_to_implementation == 0:
-            self.implement_measure(i,end)
-            #print(self,'implemented!')
-        elif self.time_to_implementation < 0:
-            #This is a situation that occured in the model version 14/10/2020, if implementation times become to small
-            raise ValueError('Somehow the time_to_implementation became negative for measure {} in timestep {}'.format(self,i))
+    def copy(self):
+        "New measure with the same name, lead time and heightening, that is not yet planned"
+        return type(self)(self.name,self.lead_time,self.heightening)
 
     def __repr__(self):
-        if hasattr(self,'time_to_implementation'):
-            extra_string = ", time_to_implementation: " + str(self.time_to_implementation) + "y"
+        if hasattr(self,'implementation_step'):
+            extra_string = ", implemented in timestep: " + str(self.implementation_step)
         else:
-            extra_string = ', not yet implemented'
+            extra_string = ', not yet planned'
         return self.name + ", lead_time: " + str(self.lead_time) + "y, heightening: " + str(self.heightening) + "m " + extra_string
         
         
@@ -803,8 +1719,11 @@ class Measure_FloodProtection(Measure):
         self.heightening = heightening
     
     def implement_measure(self,i,end):
-        self.apply_to.protection_level[i:end] = [self.apply_to.protection_level[i] + self.heightening] * (end-i)
-        allactiveMeasure.remove(self) #remove the measure from the active measure list
+        #The protection level is constant from the last implemented measure onwards, so the heightening 
+        #is applied by setting the tail of the array to the new level (in place: the areas refer to it)
+        protection_level = self.apply_to.protection_level
+        protection_level[i:end] = protection_level[i] + self.heightening
+        self.cancel() #remove the measure from the active measures
         
 class Measure_ResidentialArea(Measure):
     def __init__(self,name,lead_time,heightening):
@@ -827,6 +1746,55 @@ def Gumbel_RP(h,mu,beta):
     "Returns the Return Period (years) of the event with a certain storm surge height in m"
     return 1/(1-Gumbel(h,mu,beta))
 
+def Gumbel_array(x,mu,beta):
+    "Gumbel() for an array of values x"
+    return np.exp(-1* np.exp((mu-np.asarray(x))/beta))
+
+def Gumbel_RP_array(h,mu,beta):
+    """
+    Gumbel_RP() for an array of storm surge heights h, e.g. the protection levels of many timesteps
+    Note that NumPy's exp() may differ from math.exp() in the last digit
+    """
+    return 1/(1-Gumbel_array(h,mu,beta))
+
+class GumbelTable():
+    """
+    Return levels and probabilities of a fixed list of return periods, for one Gumbel distribution
+    Normally obtained with Model.Gumbel_table(RPs)
+    
+    Attributes:
+        *RPs* (list) : the return periods [years]
+        *return_levels* (list of floats) : the storm surge heights [m] of the return periods, 
+                                           same values as Gumbel_inverse(RP,mu,beta)
+        *probabilities* (list of floats) : the exceedance probabilities (1/RP)
+        *RPs_array*, *return_levels_array*, *probabilities_array* : the same as NumPy arrays
+    """
+    def __init__(self,RPs,mu,beta):
+        self.mu = mu
+        self.beta = beta
+        self.RPs = list(RPs)
+        self.return_levels = [Gumbel_inverse(RP,mu,beta) for RP in self.RPs]
+        self.probabilities = [1/RP for RP in self.RPs]
+        self.RPs_array = np.array(self.RPs,dtype=float)
+        self.return_levels_array = np.array(self.return_levels)
+        self.probabilities_array = np.array(self.probabilities)
+    
+    def waterlevels(self,sealevel):
+        """
+        The water levels of the events for an array of sea levels (return_level + sea level)
+        
+        Returns:
+            *waterlevels* (2D-array) : sea levels in the rows, RPs in the columns
+        """
+        return self.return_levels_array[np.newaxis,:] + np.asarray(sealevel,dtype=float)[:,np.newaxis]
+    
+    def return_period(self,h):
+        "Return periods of an array of storm surge heights h, see Gumbel_RP_array()"
+        return Gumbel_RP_array(h,self.mu,self.beta)
+    
+    def __repr__(self):
+        return "GumbelTable(mu={}, beta={}): ".format(self.mu,self.beta) + str(list(zip(self.RPs,self.return_levels)))
+
 def shift_subjective_floods(return_periods,risk_perception_factor):
     """
     Shifts an objective series of return periods of flood events to account for changes in risk perception
@@ -876,6 +1844,44 @@ def shift_subjective_floods(return_periods,risk_perception_factor):
     ################ END #############
     
     return RPs_shifted
+
+def perception_factor_array(risk_perception_factor,exact=True):
+    """
+    The factor shift_subjective_floods applies to the probability of events, for an array of risk perception factors
+    
+    Arguments:
+        *risk_perception_factor* (array) - risk perception indicators [0,1], e.g. one per year
+        *exact* (bool) - if True, evaluate the power per element, so that the result is identical to 
+                         shift_subjective_floods. If False, use np.power (faster, may differ in the last digit)
+    
+    Returns:
+        *factor* (array) - same shape as risk_perception_factor
+    """
+    RPf = np.asarray(risk_perception_factor,dtype=float)
+    outside = ~((0 <= RPf) & (RPf <= 1)) #also catches NaN
+    if outside.any():
+        raise ValueError('Risk perception factor should be float between 0 and 1, not {}'.format(RPf[outside][0]))
+    if exact:
+        return np.array([10**(2*x-1) for x in RPf.ravel().tolist()]).reshape(RPf.shape)
+    return np.power(10.,2*RPf-1)
+
+def shift_subjective_floods_array(return_periods,risk_perception_factor,exact=True):
+    """
+    Array version of shift_subjective_floods: shifts the return periods for many risk perception factors at once,
+    giving the same result as shift_subjective_floods for each of them (if exact=True)
+    
+    Arguments:
+        *return_periods* (array) - return periods of flood events [years], shape (nr of RPs); or 
+                                   (years x nr of RPs) if the return periods differ per year
+        *risk_perception_factor* (array) - risk perception indicator [0,1] per year, shape (years)
+        *exact* (bool) - see perception_factor_array
+    
+    Returns:
+        *perceived_return_periods* (array) - shape (years x nr of RPs)
+    """
+    factor = perception_factor_array(risk_perception_factor,exact)
+    RPs = np.asarray(return_periods,dtype=float)
+    return 1 / (factor[...,np.newaxis] * (1 / RPs))
         
         
 
@@ -890,6 +1896,7 @@ def risk_FP(dam,RPs,PL):
         *RPs* (list) - the return periods (in years) of the events corresponding to these 
            damage estimates - from high to low RPs (order of both lists should match!) 
         *PL* (integer) - the flood protection level in years
+        (the input lists are not changed)
     
     Returns:
         *risk* (float) - the estimated flood risk in Euro/y
@@ -899,9 +1906,13 @@ def risk_FP(dam,RPs,PL):
      - Damage for RPs lower than the smallest RP is 0.
      - Damage of events in between known RPs are interpolated linearly with RP.
     """
-    if not sorted(RPs, reverse=True) == RPs:
+    if not sorted(RPs, reverse=True) == list(RPs):
         raise ValueError('RPs is not provided in the right format. Should be a descending list of RPs, e.g. [500,100,10]')
     
+    #work on copies, so the input lists are not changed
+    dam = list(dam)
+    RPs = list(RPs)
+    
     if RPs[-1] < PL < RPs[0]: #if protection level is somewhere between the minimum and maximum available return period
         pos = RPs.index(next(i for i in RPs if i < PL)) #find position of first RP value < PL; this is the point which need to be altered
         dam = dam[0:pos+1] #remove all the values with smaller RPs than the PL
@@ -921,9 +1932,74 @@ def risk_FP(dam,RPs,PL):
     integral = np.trapz(y=dam,x=Rfs).round(2)
     return integral
 
-
-
-        
-
-        
-        
+def risk_FP_array(dam,RPs,PL):
+    """
+    Array version of risk_FP: integrates the damages for many protection levels at once,
+    giving the same result as risk_FP for each of them. The inputs are not changed.
+    
+    Arguments:
+        *dam* (array) - damage estimates, shape (..., nr of RPs) - from high to low RPs in the last axis
+        *RPs* (array) - the return periods corresponding to the damage estimates - from high to low RPs
+                        either 1D (the same for all protection levels), or the same shape as dam 
+                        (e.g. perceived return periods, which differ per timestep)
+        *PL* (array) - the flood protection levels in years, shape (...)
+    
+    Returns:
+        *risk* (array) - the estimated flood risk in Euro/y, shape (...)
+    
+    See risk_FP for the assumptions of the risk calculation
+    """
+    dam = np.asarray(dam,dtype=float)
+    shape = dam.shape[:-1]
+    k = dam.shape[-1]
+    dam = dam.reshape(-1,k)
+    m = dam.shape[0]
+    PL = np.broadcast_to(np.asarray(PL,dtype=float),shape).reshape(m)
+    RPs = np.asarray(RPs,dtype=float)
+    shared_RPs = RPs.ndim == 1
+    descending = np.all(RPs[...,:-1] >= RPs[...,1:],axis=-1) #per row, if the RPs are given per row
+    if not np.all(descending):
+        raise ValueError('RPs is not provided in the right format. Should be a descending list of RPs, e.g. [500,100,10], not {}'.format(
+            RPs[~descending][0].tolist()))
+    RPs = np.broadcast_to(RPs,shape + (k,)).reshape(m,k)
+    risk = np.empty(m)
+    
+    #protection level is larger than the largest simulated event
+    high = PL >= RPs[:,0]
+    risk[high] = (1/PL[high]) * dam[high,0]
+    
+    #add the maximum damage for the 1:inf event, and its probability 0 
+    y = np.concatenate([dam[:,0:1],dam],axis=1)
+    x = np.concatenate([np.zeros((m,1)),1/RPs],axis=1)
+    n_points = np.full(m,k+1)
+    
+    #protection level somewhere between the minimum and maximum available return period
+    rows = np.nonzero((RPs[:,-1] < PL) & (PL < RPs[:,0]))[0]
+    if shared_RPs: #position of first RP value < PL
+        pos = np.searchsorted(-RPs[0],-PL[rows],side='right')
+    else:
+        pos = (RPs[rows] >= PL[rows,np.newaxis]).sum(axis=1)
+    #interpolate the damage at the RP of the PL (over the probabilities), and make it the last point
+    x_pl = 1/PL[rows]
+    y_pl = _interp_between(x_pl,x[rows,pos],x[rows,pos+1],y[rows,pos],y[rows,pos+1])
+    x[rows,pos+1] = x_pl
+    y[rows,pos+1] = y_pl
+    n_points[rows] = pos+2
+    
+    #integrate all rows with the same number of points at once
+    todo = ~high
+    for length in np.unique(n_points[todo]):
+        sel = np.nonzero(todo & (n_points == length))[0]
+        risk[sel] = np.trapz(y=y[sel,0:length],x=x[sel,0:length],axis=1).round(2)
+    return risk.reshape(shape)
+
+def _interp_between(x,x0,x1,y0,y1):
+    """
+    Elementwise linear interpolation between (x0,y0) and (x1,y1), 
+    giving the same results as np.interp(x,[x0,x1],[y0,y1]) for each element
+    """
+    with np.errstate(divide='ignore',invalid='ignore'):
+        slope = (y1 - y0) / (x1 - x0)
+        inbetween = slope * (x - x0) + y0
+    inbetween = np.where(x == x0,y0,inbetween)
+    return np.where(x < x0,y0,np.where(x >= x1,y1,inbetween))
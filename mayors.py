@@ -8,7 +8,7 @@ github.com/keesvanginkel
 
 __author__ = '{Kees van Ginkel}'
 
-import copy
+from inspect import isabstract
 
 from classes import *
 
@@ -18,21 +18,72 @@ from classes import *
 measure_bonus_factor = 0.5 #fraction of the years of the smaller measure, that implementing 
                            #the new measure will go faster
 
-class Reactive(Mayor):
+def propose_measure(FP,measure,i):
     """
-    Reactive management strategy:
-    In case of near miss: implements a Small dike heightening
-    In case of a flood event: implements a Large dike heightening
-    
+    The decision rule shared by all mayors, for a measure that is triggered in timestep i:
+     - if no measure is in progress for the flood protection object, the measure is planned
+     - if a smaller measure is in progress, it is replaced by the new measure, which can be
+       implemented faster: the lead time is reduced with a bonus for the years they were 
+       already working on the old measure
+     - otherwise (a measure that is the same or larger is in progress) nothing happens
+    
+    Arguments:
+        *FP* (FloodProtection object) : the object to which to apply the measure
+        *measure* (Measure_FloodProtection) : the measure (template, is not changed)
+        *i* (int) : index of timestep
     """
-    def get_name(self):
-        return('R. Active')
-    
-    def get_full_name(self):
-        return('mr. Ree Active')
-    
-    def paper_name(self):
-        return('Reactive')
+    measure_inprogress = FP.measure_in_progress #at most one measure per FP is in progress
+    if measure_inprogress is None: #there are no active measures
+        measure.copy().plan_measure(FP,i)
+    elif measure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
+        #number of years they were already working on the old measure before they decided
+        #that they should give up and work on the new measures
+        already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation(i)
+        bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
+        bonus = max(0,bonus) #bonus should never become smaller than 0 
+        
+        measure_inprogress.cancel() #remove the old measure from the active measures
+        
+        newmeasure = measure.copy()
+        newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
+        newmeasure.plan_measure(FP,i)
+
+
+class ThresholdMayor(Mayor):
+    """
+    Mayor that manages the flood protection of one area, on the basis of one signal (a variable 
+    of the ResidentialArea, e.g. the risk): when the signal triggers the small or the large measure,
+    the measure is proposed (see propose_measure).
+    
+    A strategy only declares the signal and the thresholds, and when they trigger a measure 
+    (method triggers). The same definitions are used by run_model.Batch for many experiments at once.
+    
+    Class attributes:
+        *signal* (string) : name of the variable of the ResidentialArea the mayor watches
+        *area* (int) : index of the ResidentialArea of which the signal is used (the City Centre)
+        *flood_protection* (int) : index of the FloodProtection object to which the measures are applied
+        *threshold_small*, *threshold_large* : thresholds of the small and large measure (if any)
+        *proofing_area* (int) : index of the ResidentialArea that is flood proofed when its risk 
+                                exceeds *proofing_threshold* (None: no flood proofing)
+    """
+    signal = None
+    area = 1
+    flood_protection = 1
+    threshold_small = None
+    threshold_large = None
+    proofing_area = None
+    proofing_threshold = None
+    
+    @abstractmethod
+    def triggers(self,signal):
+        """
+        Arguments:
+            *signal* (value or array) : value(s) of the signal in this timestep
+        
+        Returns:
+            *small*, *large* (bool or boolean arrays) : if the small / large measure is triggered
+        """
+        pass
     
     def apply_strategy(self,Model,SurgeLevel,Measures,i,time):
         """
@@ -47,70 +98,73 @@ class Reactive(Mayor):
         Effect of this method is that Measures will be implemented 
         in the model object after some lead time
         """
+        #FLOOD PROOFING (ONLY FOR SOME MAYORS)
+        if self.proofing_area is not None:
+            RA = Model.allResidentialArea[self.proofing_area]
+            if hasattr(RA,'flood_proofing'): #Guarantee backward compat. (20 aug)
+                if RA.risk[i] > self.proofing_threshold: #implement measure if risk gets above certain threshold
+                    RA.flood_proofing[i:] = [True] * len(RA.flood_proofing[i:])
+        
         #DRAW MEASURES FROM THE LIST
         small = Measures[0]
         large = Measures[1]
         
-        #STRATEGY FOR THE OUTERDIKE AREA
-        #TODO
-        
-        #STRATEGY FOR THE CITY CENTRE
-        CC = Model.allResidentialArea[1]
-        FP = Model.allFloodProtection[1] #the object to which to apply the heightening
-        
-        if CC.event_history[i] == "!": #Near miss event
-            #print('Small measure triggered', str(time[i]))
-            #print(small.name, small.lead_time)
-            #check if there are already measures planned
-            newmeasure = copy.deepcopy(small) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                Measure_inprogress = lst[0]
-                #IN THIS CASE WE DON'T NEED TO CHECK FURTHER! 
-                #BECAUSE THIS IS THE SMALLEST MEASURE, 
-                #AN EXISTING MEASURE WILL ALWAYS BE THE SAME OR LARGER THAN THE NEW IDEA!
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-            
-        if CC.event_history[i] == "~": #Flood
-            #print('Large measure triggered')
-            #check if there are already measures planned
-            newmeasure = copy.deepcopy(large) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                measure_inprogress = lst[0]
-                if newmeasure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
-                    #print('A special situation occurs. The old plan was: {}'.format(measure_inprogress))
-                    #print('The new plan is: {}'.format(newmeasure))
-                    
-                    #number of years they were already working on the old measure before they decided
-                    #that they should give up and work on the new measures
-                    already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation
-                    bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
-                    bonus = max(0,bonus) #bonus should never become smaller than 0 
-                    
-                    allactiveMeasure.remove(measure_inprogress) #remove the old measure from the active measure list
-                    
-                    #print('The bonus is: {}'.format(bonus))
-                    newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
-                    #print('So the new planned measure is: {}'.format(newmeasure))
-                    newmeasure.plan_measure(FP,i)
-                    #print(allactiveMeasure)
-   
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-    
-class Lawkeeper(Mayor):
+        RA = Model.allResidentialArea[self.area]
+        FP = Model.allFloodProtection[self.flood_protection] #the object to which to apply the heightening
+        trigger_small, trigger_large = self.triggers(getattr(RA,self.signal)[i])
+        if trigger_small:
+            propose_measure(FP,small,i)
+        if trigger_large:
+            propose_measure(FP,large,i)
+
+
+def mayor_classes(base=Mayor):
+    """
+    All mayors that can be used (subclasses of base that are not abstract)
+    
+    Returns:
+        *classes* (dict) : class name -> class
+    """
+    classes = {}
+    for cls in base.__subclasses__():
+        if not isabstract(cls):
+            classes[cls.__name__] = cls
+        classes.update(mayor_classes(cls))
+    return classes
+
+
+class Reactive(ThresholdMayor):
+    """
+    Reactive management strategy:
+    In case of near miss: implements a Small dike heightening
+    In case of a flood event: implements a Large dike heightening
+    
+    """
+    signal = 'event_history' #of the City Centre
+    
+    def get_name(self):
+        return('R. Active')
+    
+    def get_full_name(self):
+        return('mr. Ree Active')
+    
+    def paper_name(self):
+        return('Reactive')
+    
+    def triggers(self,event):
+        return (event == "!"), (event == "~") #Near miss event, Flood
+    
+class Lawkeeper(ThresholdMayor):
     """
     Management strategy that follows a the flood protection standards
     When the return period of the flood protection is below a threshold,
     action needs to be taken.
     """
-
+    signal = 'protection_level_rp' #of the City Centre
+    
+    #The law prescripes the following thresholds
+    threshold_small = 10000 #Underceedance threshold for implementing small upgrade return period (year)
+    threshold_large = 2000 #Underceedance threshold for implementing large upgrade return period (year)
     
     def get_name(self):
         return('Lawkeeper')
@@ -121,84 +175,21 @@ class Lawkeeper(Mayor):
     def paper_name(self):
         return('Proactive')
     
-    def apply_strategy(self,Model,SurgeLevel,Measures,i,time):
-        """
-        Arguments:
-            *Model* (Model object)
-            *SurgeLevel* (SurgeLevel object)
-            *Measures* (tuple of measures) = (small,large)
-                tuple items are of type 'Measure_FloodProtection'
-            *i* (int) : index of timestep
-            *time* (int) : year of timestep
-            
-        Effect of this method is that Measures will be implemented 
-        in the model object after some lead time
-        """
-        #DRAW MEASURES FROM THE LIST
-        small = Measures[0]
-        large = Measures[1]
-        
-        #The law prescripes the following thresholds
-        self.threshold_small = 10000 #Underceedance threshold for implementing small upgrade return period (year)
-        self.threshold_large = 2000 #Underceedance threshold for implementing large upgrade return period (year)
-        
-        #STRATEGY FOR THE OUTERDIKE AREA
-        #NO STRATEGY FOR THE HEIJPLAAT
-        
-        #STRATEGY FOR THE INNERDIKE AREA
-        CC = Model.allResidentialArea[1] #City Centre object
-        FP = Model.allFloodProtection[1] #the object to which to apply the heightening
-        
-        if self.threshold_large < CC.protection_level_rp[i] <= self.threshold_small:
-            #print('Small measure triggered')
-            #check if there are already measures planned
-            newmeasure = copy.deepcopy(small) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                Measure_inprogress = lst[0]
-                #IN THIS CASE WE DON'T NEED TO CHECK FURTHER! 
-                #BECAUSE THIS IS THE SMALLEST MEASURE, 
-                #AN EXISTING MEASURE WILL ALWAYS BE THE SAME OR LARGER THAN THE NEW IDEA!
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-        
-        if CC.protection_level_rp[i] <= self.threshold_large:
-            #print('Large measure triggered')
-            #check if there are already measures planned
-            newmeasure = copy.deepcopy(large) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                measure_inprogress = lst[0]
-                if newmeasure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
-                    #print('A special situation occurs. The old plan was: {}'.format(measure_inprogress))
-                    #print('The new plan is: {}'.format(newmeasure))
-                    
-                    #number of years they were already working on the old measure before they decided
-                    #that they should give up and work on the new measures
-                    already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation
-                    bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
-                    bonus = max(0,bonus) #bonus should never become smaller than 0 
-                    
-                    allactiveMeasure.remove(measure_inprogress) #remove the old measure from the active measure list
-                    
-                    #print('The bonus is: {}'.format(bonus))
-                    newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
-                    #print('So the new planned measure is: {}'.format(newmeasure))
-                    newmeasure.plan_measure(FP,i)
-                    #print(allactiveMeasure)
-   
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)            
+    def triggers(self,rp):
+        return (self.threshold_large < rp) & (rp <= self.threshold_small), (rp <= self.threshold_large)
 
-class Economicus(Mayor):
+class Economicus(ThresholdMayor):
     """
     Management strategy on the basis of a objective risk thresholds (may result from cost-benefit analysis)
     
     """
+    signal = 'risk' #of the City Centre
+    
+    #We assume that from CBA follow these threshold (mln euro per year)
+    #15/2/2021, changed samll value from 5 to 2
+    #22/2 set to 4
+    threshold_small = 4 #Underexceedance threshold for implementing small upgrade (mln euro per year)
+    threshold_large = 10 #Underexceedance threshold for implementing large upgrade (mln euro per year)
     
     def get_name(self):
         return('H. Economicus')
@@ -209,81 +200,24 @@ class Economicus(Mayor):
     def paper_name(self):
         return('Economic')
     
-    def apply_strategy(self,Model,SurgeLevel,Measures,i,time):
-        """
-        Arguments:
-            *Model* (Model object)
-            *SurgeLevel* (SurgeLevel object)
-            *Measures* (tuple of measures) = (small,large)
-                tuple items are of type 'Measure_FloodProtection'
-            *i* (int) : index of timestep
-            *time* (int) : year of timestep
-            
-        Effect of this method is that Measures will be implemented 
-        in the model object after some lead time
-        """
-        #We assume that from CBA follow these threshold (mln euro per year)
-        #15/2/2021, changed samll value from 5 to 2
-        #22/2 set to 4
-        self.threshold_small = 4 #Underexceedance threshold for implementing small upgrade (mln euro per year)
-        self.threshold_large = 10 #Underexceedance threshold for implementing large upgrade (mln euro per year)
-        
-        
-        #DRAW MEASURES FROM THE LIST
-        small = Measures[0]
-        large = Measures[1]
-        
-        #STRATEGY FOR THE CITY CENTRE
-        CC = Model.allResidentialArea[1]
-        FP = Model.allFloodProtection[1] #the object to which to apply the heightening
-
-        if self.threshold_small <= CC.risk[i] < self.threshold_large: #If the flood risk in the City Centre exceeds X mln euro per year
-            newmeasure = copy.deepcopy(small) #make a copy of the measure to implement    
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                Measure_inprogress = lst[0]
-                #IN THIS CASE WE DON'T NEED TO CHECK FURTHER! 
-                #BECAUSE THIS IS THE SMALLEST MEASURE, 
-                #AN EXISTING MEASURE WILL ALWAYS BE THE SAME OR LARGER THAN THE NEW IDEA!
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-
-        elif CC.risk[i] >= self.threshold_large: #If the flood risk in the City Centre exceeds X mln euro per year
-            newmeasure = copy.deepcopy(large) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                measure_inprogress = lst[0]
-                if newmeasure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
-                    #print('A special situation occurs. The old plan was: {}'.format(measure_inprogress))
-                    #print('The new plan is: {}'.format(newmeasure))
-                    
-                    #number of years they were already working on the old measure before they decided
-                    #that they should give up and work on the new measures
-                    already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation
-                    bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
-                    bonus = max(0,bonus) #bonus should never become smaller than 0 
-                    
-                    allactiveMeasure.remove(measure_inprogress) #remove the old measure from the active measure list
-                    
-                    #print('The bonus is: {}'.format(bonus))
-                    newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
-                    #print('So the new planned measure is: {}'.format(newmeasure))
-                    newmeasure.plan_measure(FP,i)
-                    #print(allactiveMeasure)
-   
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
+    def triggers(self,risk): #If the flood risk in the City Centre exceeds X mln euro per year
+        return (self.threshold_small <= risk) & (risk < self.threshold_large), (risk >= self.threshold_large)
 
-class Economicus_HP_iter(Mayor):
+class Economicus_HP_iter(Economicus):
     """
     Management strategy on the basis of a objective risk thresholds (may result from cost-benefit analysis)
     
     In addition to the normal behaviour of economicus, this mayor will implement a measure on the Heijplaat.
     
     """
+    #15/2/2021, changed samll value from 5 to 2
+    #22/2 set to 3
+    threshold_small = 4 #Underceedance threshold for implementing small upgrade return period (year)
+    threshold_large = 10 #Underceedance threshold for implementing large upgrade return period (year)
+    
+    #STRATEGY FOR THE HEIJPLAAT: flood proofing if the risk gets above 0.5 mln euro per year
+    proofing_area = 0
+    proofing_threshold = 0.5
     
     def get_name(self):
         return('H. Economicus_iter')
@@ -293,94 +227,20 @@ class Economicus_HP_iter(Mayor):
     
     def paper_name(self):
         return('Economic_iter')
-    
-    def apply_strategy(self,Model,SurgeLevel,Measures,i,time):
-        """
-        Arguments:
-            *Model* (Model object)
-            *SurgeLevel* (SurgeLevel object)
-            *Measures* (tuple of measures) = (small,large)
-                tuple items are of type 'Measure_FloodProtection'
-            *i* (int) : index of timestep
-            *time* (int) : year of timestep
-            
-        Effect of this method is that Measures will be implemented 
-        in the model object after some lead time
-        """
-        #We assume that from CBA follow these threshold (mln euro per year)
-        
-        #15/2/2021, changed samll value from 5 to 2
-        #22/2 set to 3
-        self.threshold_small = 4 #Underceedance threshold for implementing small upgrade return period (year)
-        self.threshold_large = 10 #Underceedance threshold for implementing large upgrade return period (year)
-        
-        
-        #DRAW MEASURES FROM THE LIST
-        small = Measures[0]
-        large = Measures[1]
-        
-        
-        #STRATEGY FOR THE HEIJPLAAT
-        HP = Model.allResidentialArea[0] #Select the Heijplaat Residential Area object
         
-        if hasattr(HP,'flood_proofing'): #Guarantee backward compat. (20 aug)
-            if HP.risk[i] > 0.5: #implement measure if risk gets above certain threshold
-                HP.flood_proofing[i:] = [True] * len(HP.flood_proofing[i:])
-                #print('measure implemented in i={} and time={}'.format(i,time[i]))
-            
-        
-        #STRATEGY FOR THE CITY CENTRE
-        CC = Model.allResidentialArea[1]
-        FP = Model.allFloodProtection[1] #the object to which to apply the heightening
-
-        if self.threshold_small <= CC.risk[i] < self.threshold_large: #If the flood risk in the City Centre exceeds X mln euro per year
-            newmeasure = copy.deepcopy(small) #make a copy of the measure to implement    
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                Measure_inprogress = lst[0]
-                #IN THIS CASE WE DON'T NEED TO CHECK FURTHER! 
-                #BECAUSE THIS IS THE SMALLEST MEASURE, 
-                #AN EXISTING MEASURE WILL ALWAYS BE THE SAME OR LARGER THAN THE NEW IDEA!
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-
-        elif CC.risk[i] >= self.threshold_large: #If the flood risk in the City Centre exceeds X mln euro per year
-            newmeasure = copy.deepcopy(large) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                measure_inprogress = lst[0]
-                if newmeasure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
-                    #print('A special situation occurs. The old plan was: {}'.format(measure_inprogress))
-                    #print('The new plan is: {}'.format(newmeasure))
-                    
-                    #number of years they were already working on the old measure before they decided
-                    #that they should give up and work on the new measures
-                    already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation
-                    bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
-                    bonus = max(0,bonus) #bonus should never become smaller than 0 
-                    
-                    allactiveMeasure.remove(measure_inprogress) #remove the old measure from the active measure list
-                    
-                    #print('The bonus is: {}'.format(bonus))
-                    newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
-                    #print('So the new planned measure is: {}'.format(newmeasure))
-                    newmeasure.plan_measure(FP,i)
-                    #print(allactiveMeasure)
-   
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)            
         
-        
-class Sentiment(Mayor):
+class Sentiment(ThresholdMayor):
     """
     Management strategy on the basis of perceived risk thresholds 
     
     """
+    signal = 'risk_perceived' #of the City Centre
     
-    #TODO: THRESHOLDS AS ATTRIBUTES OF THE CLASS
+    #We assume that from CBA follow these threshold (mln euro per year)
+    #15/2/2021, changed samll value from 5 to 2
+    #22/2 Set to 4
+    threshold_small = 4 #Underceedance threshold for implementing small upgrade return period (year)
+    threshold_large = 10 #Underceedance threshold for implementing large upgrade return period (year)
     
     def get_name(self):
         return('Sentiment')
@@ -391,70 +251,5 @@ class Sentiment(Mayor):
     def paper_name(self):
         return('Sentiment')
     
-    def apply_strategy(self,Model,SurgeLevel,Measures,i,time):
-        """
-        Arguments:
-            *Model* (Model object)
-            *SurgeLevel* (SurgeLevel object)
-            *Measures* (tuple of measures) = (small,large)
-                tuple items are of type 'Measure_FloodProtection'
-            *i* (int) : index of timestep
-            *time* (int) : year of timestep
-            
-        Effect of this method is that Measures will be implemented 
-        in the model object after some lead time
-        """
-        #We assume that from CBA follow these threshold (mln euro per year)
-        
-        #15/2/2021, changed samll value from 5 to 2
-        #22/2 Set to 4
-        self.threshold_small = 4 #Underceedance threshold for implementing small upgrade return period (year)
-        self.threshold_large = 10 #Underceedance threshold for implementing large upgrade return period (year)
-        
-        #DRAW MEASURES FROM THE LIST
-        small = Measures[0]
-        large = Measures[1]
-        
-        #STRATEGY FOR THE CITY CENTRE
-        CC = Model.allResidentialArea[1]
-        FP = Model.allFloodProtection[1] #the object to which to apply the heightening
-
-        if self.threshold_small <= CC.risk_perceived[i] < self.threshold_large: 
-            newmeasure = copy.deepcopy(small) #make a copy of the measure to implement    
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                Measure_inprogress = lst[0]
-                #IN THIS CASE WE DON'T NEED TO CHECK FURTHER! 
-                #BECAUSE THIS IS THE SMALLEST MEASURE, 
-                #AN EXISTING MEASURE WILL ALWAYS BE THE SAME OR LARGER THAN THE NEW IDEA!
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
-
-        elif CC.risk_perceived[i] >= self.threshold_large: #If the perceived flood risk in the City Centre exceeds X mln euro per year
-            newmeasure = copy.deepcopy(large) #make a copy of the measure to implement
-            
-            lst = [Measure for Measure in allactiveMeasure if Measure.apply_to.name == FP.name]
-            #list is either empty or has an active object
-            if len(lst) != 0: #if there is an active measure
-                measure_inprogress = lst[0]
-                if newmeasure.heightening > measure_inprogress.heightening: #the new plan is larger than the old one
-                    #print('A special situation occurs. The old plan was: {}'.format(measure_inprogress))
-                    #print('The new plan is: {}'.format(newmeasure))
-                    
-                    #number of years they were already working on the old measure before they decided
-                    #that they should give up and work on the new measures
-                    already_working_on_it = measure_inprogress.lead_time - measure_inprogress.time_to_implementation
-                    bonus = int(round(already_working_on_it*measure_bonus_factor,0)) #how much faster can the new measure go?
-                    bonus = max(0,bonus) #bonus should never become smaller than 0 
-                    
-                    allactiveMeasure.remove(measure_inprogress) #remove the old measure from the active measure list
-                    
-                    #print('The bonus is: {}'.format(bonus))
-                    newmeasure.lead_time = newmeasure.lead_time - bonus #you can implement the new plan faster!
-                    #print('So the new planned measure is: {}'.format(newmeasure))
-                    newmeasure.plan_measure(FP,i)
-                    #print(allactiveMeasure)
-   
-            else: #there are no active measures
-                newmeasure.plan_measure(FP,i)
+    def triggers(self,risk_perceived): #If the perceived flood risk in the City Centre exceeds X mln euro per year
+        return (self.threshold_small <= risk_perceived) & (risk_perceived < self.threshold_large), (risk_perceived >= self.threshold_large)
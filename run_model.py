@@ -9,8 +9,13 @@ __author__ = '{Kees van Ginkel}'
 
 
 from classes import *
+from mayors import measure_bonus_factor, mayor_classes, ThresholdMayor
 
-def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False):  
+#Return periods of the synthetic events used for the risk assessment in each timestep
+synthetic_RPs = [10000,5000,2000,1000,500,200,100,50,20,10,5,2]
+
+def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False,detectors=None,stop_early=False,
+                last_timestep=None):  
     """
     The algorithm describing all the steps in one model experiment
     
@@ -20,6 +25,15 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
         *Mayor* (Mayor object) : The mayor for this experiment
         *Implementation_time* (tuple) : Implementation time of the large and small measures respectively 
             Tuple elements (int) : Time in years
+        *detectors* (dict) : (optional) tipping point analysis during the run: keys (area name, variable), 
+            values tipping.SETPDetector objects, which receive the value of the variable in each timestep
+            e.g. {('Area_A','house_price_t_objective') : SETPDetector(...)}
+        *stop_early* (bool) : stop the run as soon as all detectors know the first SETP 
+            (the remaining timesteps are not simulated)
+        *last_timestep* (int) : (optional) index of the last timestep to simulate, the variables of later
+            timesteps keep their initial values (NaN). Earlier timesteps do not depend on later ones.
+            The detectors then receive one NaN after the last timestep, which closes the open stable 
+            state as in the full time series of the variable (with NaN after last_timestep).
         
     Returns:
         *Experiment* (Experiment) : Contains all input arguments including the development of the model over time
@@ -32,15 +46,22 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
     large = Measure_FloodProtection("Major Dike Heightening", Implementation_time[1], 1)
     Measures = (small,large)
     
-    #REMOVE ALL ACTIVE MEASURES FROM PREVIOUS RUNS
-    allactiveMeasure.clear()
+    #START A NEW RUN: OWN COPY OF THE MODEL AND OWN LIST OF ACTIVE MEASURES
+    run = RunContext(Model)
+    Model = run.Model
     
     time = SurgeLevel.years
     init_time(Model,time) #Initiate time for objects that have changing variables over time
+    areas = {RA.name : RA for RA in Model.allResidentialArea}
 
     # THE MODEL RUNS OVER A YEARLY TIMESTEP
+    stopped = False
+    truncated = False
     for i,t in enumerate(time): #Iterate over the years t, with index i
         #print(i,t, end=" |")
+        if last_timestep is not None and i > last_timestep:
+            truncated = True
+            break
         time_remaining = len(time) - i 
         
         for RA in Model.allResidentialArea:
@@ -73,12 +94,12 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
             SLR = SurgeLevel.corresponding_SLR_Scenario.sealevel[i] #the degree of SLR in this timestep
             max_surge = RA.protection_level[i]-SLR #the maximum storm surge height this dike can cope with
             RA.protection_level_rp[i] = Gumbel_RP(max_surge,mu,beta) #Return period of the flood protection height
-            RPs = [10000,5000,2000,1000,500,200,100,50,20,10,5,2]
-            damages = [] #per neighborhood
-            damages_household = []
-            for RP in RPs:
+            RPs = synthetic_RPs
+            return_levels = Model.Gumbel_table(RPs).return_levels #Gumbel_inverse(RP,mu,beta), calculated once per model
+            inundations = []
+            for RP, return_level in zip(RPs,return_levels):
                 #Expected water levels are the sum of the Gumbel distributed WLs 
-                waterlevel = Gumbel_inverse(RP,mu,beta) + SLR
+                waterlevel = return_level + SLR
                 
                 #Impose volume constraint
                 overtopping = waterlevel - RA.protection_level[i]
@@ -87,20 +108,17 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
                 else: volume_attenuation_factor = 1
                 
                 #Constrain the volume upon inundation
-                inundation = (waterlevel - RA.elevation) * volume_attenuation_factor
-                
-                #Calculation per residential area
-                damages.append(RA.calculate_damage(inundation,i)) #damage assuming no FPL
-                
-                #Calculation per household
-                damages_household.append(RA.calculate_damage_household(inundation,i))
+                inundations.append((waterlevel - RA.elevation) * volume_attenuation_factor)
+            
+            #Damage per residential area and per household (assuming no FPL), for all events at once
+            damages, damages_household = RA.damage_function.calculate(inundations,RA.surface_area,RA.flood_proofing[i])
                     
-            RA.risk[i] = risk_FP(damages.copy(),RPs.copy(),RA.protection_level_rp[i])*10**(-6) #EAD of Residential area in million 2010-euro's 
-            RA.risk_household[i] = risk_FP(damages_household.copy(), RPs.copy(),RA.protection_level_rp[i]) #EAD [per household] in 2010-euros
+            RA.risk[i] = risk_FP(damages,RPs,RA.protection_level_rp[i])*10**(-6) #EAD of Residential area in million 2010-euro's 
+            RA.risk_household[i] = risk_FP(damages_household,RPs,RA.protection_level_rp[i]) #EAD [per household] in 2010-euros
 
             if time_remaining > RA.house_price_horizon:
-                future_EADs = [RA.risk_household[i]] * RA.house_price_horizon #assume that all future damages equal current EAD
-                RA.risk_household_discounted[i] = discount_risk(future_EADs,RA.r,RA.house_price_horizon)
+                #assume that all future damages equal current EAD
+                RA.risk_household_discounted[i] = discount_constant_risk(RA.risk_household[i],RA.r,RA.house_price_horizon)
                 flood_discount = RA.risk_household_discounted[i] - RA.risk_household_discounted[0] # The increase in discounted risk
                 #Calculate new house price
                 RA.house_price_t_objective[i] = RA.house_price_0 - flood_discount 
@@ -114,17 +132,15 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
                     HP = Model.allResidentialArea[0]
                     RA.weigh_RP_Bayesian(i,Model.Parameters["I_experience_interp"],I_social=HP.risk_perception[i]) 
             
-            RA.risk_perceived[i] = risk_FP(damages.copy(), #Copy of the damages
-                                           shift_subjective_floods(RPs.copy(),RA.risk_perception[i]), #perceived return periods
-                                           shift_subjective_floods(RA.protection_level_rp[i],RA.risk_perception[i]))*10**(-6) #return period of flood protection
-            RA.risk_household_perceived[i] = risk_FP(damages_household.copy(), 
-                                                     shift_subjective_floods(RPs.copy(),RA.risk_perception[i]), #perceived return periods
-                                                     shift_subjective_floods(RA.protection_level_rp[i],RA.risk_perception[i])) #EAD [per household] in 2010-euros
+            RPs_perceived = shift_subjective_floods(RPs,RA.risk_perception[i]) #perceived return periods
+            protection_level_rp_perceived = shift_subjective_floods(RA.protection_level_rp[i],RA.risk_perception[i]) #return period of flood protection
+            RA.risk_perceived[i] = risk_FP(damages,RPs_perceived,protection_level_rp_perceived)*10**(-6)
+            RA.risk_household_perceived[i] = risk_FP(damages_household,RPs_perceived,protection_level_rp_perceived) #EAD [per household] in 2010-euros
             
             #Risk discounting: for now assume that households don't anticipate any sea level rise
             if time_remaining > RA.house_price_horizon:
-                future_EADs_perceived = [RA.risk_household_perceived[i]] * RA.house_price_horizon #assume that all future damages equal current EAD
-                RA.risk_household_discounted_perceived[i] = discount_risk(future_EADs_perceived,RA.r,RA.house_price_horizon)
+                #assume that all future damages equal current EAD
+                RA.risk_household_discounted_perceived[i] = discount_constant_risk(RA.risk_household_perceived[i],RA.r,RA.house_price_horizon)
                 flood_discount_subjective = RA.risk_household_discounted_perceived[i] - RA.risk_household_discounted[0] # The increase in discounted risk
                 #Calculate new house price
                 RA.house_price_t_subjective[i] = RA.house_price_0 - flood_discount_subjective 
@@ -133,11 +149,24 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
             
         #IMPLEMENT FLOOD PROTECTION MEASURES
         Mayor.apply_strategy(Model,SurgeLevel,Measures,i,time)
-        for measure in allactiveMeasure: #tell all measures that are currently planned that a timestep has passed and that their implementation is coming near 
-            measure.countdown(i,len(time)) #we need to tell the measure instances which timestep it is
+        run.implement_measures(i,len(time)) #implement the planned measures of which the lead time has passed
         
         for Area in Model.allResidentialArea: #CAN POSSIBLY ALSO BE IMPLEMENTED AS METHOD OF MEASURE
                RA.match_with_FloodProtection(Model.allFloodProtection)
+        
+        #FEED THE VALUES OF THIS TIMESTEP TO THE TIPPING POINT DETECTORS
+        if detectors:
+            for (area, variable), detector in detectors.items():
+                detector.update(getattr(areas[area],variable)[i])
+            if stop_early and all(detector.done for detector in detectors.values()):
+                stopped = True
+                break
+    
+    if detectors and not stopped: #end of the time series
+        for detector in detectors.values():
+            if truncated: #the variable is NaN in the next timestep (not simulated)
+                detector.update(float('nan'))
+            detector.finish()
     
     experiment = Experiment(Model,SurgeLevel,Mayor,Implementation_time)
     
@@ -146,7 +175,7 @@ def run_model01(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False
     
     return experiment
 
-def init_time(Model,time,do_print=False):
+def init_time(Model,time,do_print=False,as_array=False):
     """
     Initiate all variables that change over time for all relevant objects
     And matches all areas with flood protection objects
@@ -154,18 +183,538 @@ def init_time(Model,time,do_print=False):
     Arguments:
         *Model* (Urban-SETP model object) : The model of the city
         *time* (list) : Timeseries of all years for which the model is to run
+        *as_array* (bool) : store the variables as NumPy arrays instead of lists (default False)
         
     Return:
         *Model* (Urban-SETP model object) : The model of the city with time initiated
     
     """
     for FloodProtection in Model.allFloodProtection:
-        FloodProtection.init_time(time)             
+        FloodProtection.init_time(time,as_array=as_array)             
 
     for RA in Model.allResidentialArea:
         RA.match_with_FloodProtection(Model.allFloodProtection) #ADD THE INFORMATION OF THE FLOOD PROTECTION STRUCTURES TO THE AREAS IT PROTECTS
-        RA.init_time(time) #create all the variables that are manipulated over time
+        RA.init_time(time,as_array=as_array) #create all the variables that are manipulated over time
     
     if do_print:
         print('Time is initiated for all Flood protection and Residential Area objects')
     return Model
+
+
+def run_model02(Model,SurgeLevel,Mayor,Implementation_time=(7,10),do_print=False):
+    """
+    Array-backed version of run_model01, which gives identical results
+    
+    All variables that change over time are stored as NumPy arrays. Everything the mayor 
+    does not influence (sea level, the water levels of the synthetic events) is calculated 
+    once for all years. The state of the areas (events, risk, risk perception, house prices) 
+    is calculated for all remaining years at once, assuming the flood protection stays as it is. 
+    Only when the mayor changes the flood protection (or flood proofing), the remaining years 
+    are calculated again.
+    
+    Arguments:
+        *Model* (Model object) : Model object describing the city
+        *SurgeLevel* (SurgeLevel object) : The extreme water level per year
+        *Mayor* (Mayor object) : The mayor for this experiment
+        *Implementation_time* (tuple) : Implementation time of the large and small measures respectively 
+            Tuple elements (int) : Time in years
+        
+    Returns:
+        *Experiment* (Experiment) : Contains all input arguments including the development of the model over time
+    
+    """
+    #DEFINE MEASURES THAT MANY MAYORS WILL USE
+    small = Measure_FloodProtection("Minor Dike Heightening", Implementation_time[0], 0.5)
+    large = Measure_FloodProtection("Major Dike Heightening", Implementation_time[1], 1)
+    Measures = (small,large)
+    
+    #START A NEW RUN: OWN COPY OF THE MODEL AND OWN LIST OF ACTIVE MEASURES
+    run = RunContext(Model)
+    Model = run.Model
+    
+    time = SurgeLevel.years
+    n = len(time)
+    init_time(Model,time,as_array=True) #Initiate time for objects that have changing variables over time
+    
+    #PREPARE EVERYTHING THAT DOES NOT DEPEND ON THE MAYOR
+    mu = Model.Parameters["Gumbel"]["mu"]
+    beta = Model.Parameters["Gumbel"]["beta"]
+    RPs = synthetic_RPs
+    surgelevel = np.array(SurgeLevel.surgelevel[0:n],dtype=float)
+    sealevel = np.array(SurgeLevel.corresponding_SLR_Scenario.sealevel[0:n],dtype=float)
+    #Expected water levels of the synthetic events: years in rows, return periods in columns
+    waterlevels = Model.Gumbel_table(RPs).waterlevels(sealevel)
+    
+    _evaluate_from(Model,0,surgelevel,sealevel,waterlevels,RPs,mu,beta)
+    #Save the flood protection the calculation was based on, to see when the mayor changes it
+    assumed = _protection_state(Model)
+    
+    # THE MODEL RUNS OVER A YEARLY TIMESTEP
+    for i,t in enumerate(time):
+        #IMPLEMENT FLOOD PROTECTION MEASURES
+        Mayor.apply_strategy(Model,SurgeLevel,Measures,i,time)
+        run.implement_measures(i,n) #implement the planned measures of which the lead time has passed
+        
+        #IF THE MAYOR CHANGED THE FUTURE FLOOD PROTECTION, RECALCULATE THE REMAINING YEARS
+        if i+1 < n:
+            current = _protection_state(Model,copy=False)
+            if any((c[i+1:] != a[i+1:]).any() for c,a in zip(current,assumed)):
+                _evaluate_from(Model,i+1,surgelevel,sealevel,waterlevels,RPs,mu,beta)
+                assumed = _protection_state(Model)
+    
+    experiment = Experiment(Model,SurgeLevel,Mayor,Implementation_time)
+    
+    if do_print:
+        print("Finished experiment {}".format(experiment))
+    
+    return experiment
+
+def _protection_state(Model,copy=True):
+    """
+    (Copies of) all time series the mayor can change and that feed back into the calculation (used by run_model02)
+    """
+    state = [FP.protection_level for FP in Model.allFloodProtection]
+    state.extend(RA.flood_proofing for RA in Model.allResidentialArea)
+    if copy:
+        state = [x.copy() for x in state]
+    return state
+
+def _evaluate_from(Model,start,surgelevel,sealevel,waterlevels,RPs,mu,beta):
+    """
+    Calculate the state of all residential areas from timestep start to the end of the run,
+    assuming the current flood protection levels (used by run_model02)
+    
+    Follows the same steps (and the same order of floating point operations) as run_model01
+    
+    Arguments:
+        *Model* (Model object) : Model object with time initiated as arrays
+        *start* (int) : first timestep to calculate
+        *surgelevel* (array) : storm surge level per timestep
+        *sealevel* (array) : sea level per timestep
+        *waterlevels* (2D-array) : water levels of the synthetic events (timesteps x RPs)
+        *RPs* (list) : return periods of the synthetic events, from high to low
+        *mu*, *beta* (float) : parameters of the Gumbel distribution
+    """
+    n = len(surgelevel)
+    s = slice(start,n)
+    rp_array = np.array(RPs,dtype=float)
+    
+    for RA in Model.allResidentialArea:
+        PL = RA.protection_level[s]
+        SL = surgelevel[s]
+        flood_proofing = RA.flood_proofing[s]
+        
+        #FIRST EVALUATE IF THE FLOOD PROTECTION LEVEL IS EXCEEDED
+        flood = PL < SL
+        overtopping = SL - PL
+        volume_attenuation_factor = np.where(overtopping < RA.volume_constraint_threshold,
+                                             overtopping / RA.volume_constraint_threshold,1)
+        depth = (SL - RA.elevation) * volume_attenuation_factor
+        RA.flood_history[s] = np.where(flood,depth,np.nan)
+        RA.flood_damage[s] = np.where(flood,RA.damage_function.calculate_area(depth,RA.surface_area,flood_proofing),np.nan)
+        
+        #AND EVALUATE IF ANY NEAR MISS MIGHT HAVE OCCURED
+        freeboard = PL - SL
+        nearmiss = (0 < freeboard) & (freeboard <= 0.5)
+        RA.nearmiss_history[s] = np.where(nearmiss,freeboard,np.nan)
+        RA.event_history[s] = np.where(flood,"~",np.where(nearmiss,"!",""))
+    
+    for RA in Model.allResidentialArea:
+        PL = RA.protection_level[s]
+        flood_proofing = RA.flood_proofing[s][:,np.newaxis]
+        
+        #CALCULATE THE OBJECTIVE RISK IN THE NEIGHBOURHOOD AND HOUSEHOLD
+        RA.protection_level_rp[s] = [Gumbel_RP(pl-slr,mu,beta) for pl,slr in zip(PL.tolist(),sealevel[s].tolist())]
+        protection_level_rp = RA.protection_level_rp[s]
+        
+        overtopping = waterlevels[s] - PL[:,np.newaxis]
+        volume_attenuation_factor = np.where(overtopping < RA.volume_constraint_threshold,
+                                             overtopping / RA.volume_constraint_threshold,1)
+        inundation = (waterlevels[s] - RA.elevation) * volume_attenuation_factor
+        damages, damages_household = RA.damage_function.calculate(inundation,RA.surface_area,flood_proofing)
+        
+        RA.risk[s] = risk_FP_array(damages,rp_array,protection_level_rp)*10**(-6)
+        RA.risk_household[s] = risk_FP_array(damages_household,rp_array,protection_level_rp)
+        
+        #only for the timesteps with enough remaining time to discount over the house price horizon
+        h = slice(start,max(start,n-RA.house_price_horizon))
+        RA.risk_household_discounted[h] = discount_risk_array(RA.risk_household[h],RA.r,RA.house_price_horizon)
+        RA.house_price_t_objective[h] = RA.house_price_0 - (RA.risk_household_discounted[h] - RA.risk_household_discounted[0])
+        
+        #CALCULATE THE RISK PERCEPTION
+        if RA.name == 'Area_A': #For the Heijplaat
+            _weigh_RP_Bayesian_from(RA,start,I_social=np.zeros(n))
+        elif RA.name == 'Area_B': #For the City Centre: account for risk perception in the Heijplaat
+            _weigh_RP_Bayesian_from(RA,start,I_social=Model.allResidentialArea[0].risk_perception)
+        
+        #Perceived return periods of the synthetic events and of the flood protection
+        #(the protection level is shifted as an extra return period, so the factor is evaluated once per year)
+        return_periods = np.column_stack((np.broadcast_to(rp_array,(len(protection_level_rp),len(rp_array))),protection_level_rp))
+        perceived = shift_subjective_floods_array(return_periods,RA.risk_perception[s])
+        RPs_perceived, protection_level_rp_perceived = perceived[:,:-1], perceived[:,-1]
+        RA.risk_perceived[s] = risk_FP_array(damages,RPs_perceived,protection_level_rp_perceived)*10**(-6)
+        RA.risk_household_perceived[s] = risk_FP_array(damages_household,RPs_perceived,protection_level_rp_perceived)
+        
+        RA.risk_household_discounted_perceived[h] = discount_risk_array(RA.risk_household_perceived[h],RA.r,RA.house_price_horizon)
+        RA.house_price_t_subjective[h] = RA.house_price_0 - (RA.risk_household_discounted_perceived[h] - RA.risk_household_discounted[0])
+
+def _Bayesian_coefficients(Bayesian_pars,depth,nearmiss):
+    """
+    The weighting factors and the experience used by ResidentialArea.weigh_RP_Bayesian,
+    for arrays (of any shape) of water depths and near misses
+    
+    Returns:
+        *a*, *b*, *c* (arrays) : weighting factors selected by the type of event
+        *I_exp* (array) : the experience of the event
+    """
+    depth = np.asarray(depth,dtype=float)
+    nearmiss = np.asarray(nearmiss,dtype=float)
+    event = np.where(depth > 0,2,np.where(nearmiss > 0,1,0)) #0 = nothing, 1 = near miss, 2 = flood
+    a, b, c = [np.array(x,dtype=float)[event] for x in (Bayesian_pars.a,Bayesian_pars.b,Bayesian_pars.c)]
+    I_exp = np.where(event == 2,np.interp(depth,[0,0.5],[0,1],left=0,right=1),
+                     np.where(event == 1,np.interp(nearmiss,[0,0.5],[1,0],left=1,right=0),0))
+    return a, b, c, I_exp
+
+def weigh_RP_Bayesian_array(Bayesian_pars,flood_history,nearmiss_history,risk_perception_0=0,I_social=0):
+    """
+    ResidentialArea.weigh_RP_Bayesian for the whole time series of many experiments at once
+    
+    Once the floods and near misses are known, the risk perception is a linear first-order filter
+        RP(t) = (a(t) * RP(t-1) + b(t) * I_exp(t) + c(t) * I_social(t)) / (a(t) + b(t) + c(t))
+    of which the coefficients only depend on the type of event in timestep t. These are selected for 
+    all timesteps and experiments at once; only the filter itself loops over the timesteps (for all 
+    experiments at once), in the same order of operations as weigh_RP_Bayesian, so the results are identical.
+    
+    Arguments:
+        *Bayesian_pars* (Bayesian_pars object) : weighting factors of the residential area
+        *flood_history* (array) : water depth per experiment (rows) and timestep (last axis), NaN if no flood
+        *nearmiss_history* (array) : near miss per experiment and timestep, NaN if no near miss
+        *risk_perception_0* (float or array) : risk perception in t=0 (initial condition), per experiment
+        *I_social* (float or array) : Impact of neighbouring residential areas through media, per experiment and timestep
+    
+    Returns:
+        *risk_perception* (array) : same shape as flood_history
+    """
+    a, b, c, I_exp = _Bayesian_coefficients(Bayesian_pars,flood_history,nearmiss_history)
+    I_social = np.broadcast_to(np.asarray(I_social,dtype=float),a.shape)
+    
+    #Timesteps as the first axis, so that each step of the filter uses contiguous rows
+    experience, social, total = [np.ascontiguousarray(np.moveaxis(x,-1,0)) for x in (b * I_exp,c * I_social,a + b + c)]
+    a = np.ascontiguousarray(np.moveaxis(a,-1,0))
+    
+    risk_perception = np.empty(a.shape)
+    risk_perception[0] = risk_perception_0 #the function is not applied in the first timestep
+    for t in range(1,len(risk_perception)):
+        risk_perception[t] = (a[t] * risk_perception[t-1] + experience[t] + social[t]) / total[t]
+    return np.moveaxis(risk_perception,0,-1)
+
+def risk_perception_array(Model,flood_history,nearmiss_history,risk_perception_0=0):
+    """
+    The risk perception of all residential areas of the Model, for many experiments at once
+    (see weigh_RP_Bayesian_array). As in run_model01, Area_B uses the risk perception of Area_A 
+    as social input; other areas are not updated after t=0.
+    
+    Arguments:
+        *Model* (Model object) : Model object describing the city
+        *flood_history* (3D-array) : experiments x ResidentialArea x timesteps (as in Batch)
+        *nearmiss_history* (3D-array) : experiments x ResidentialArea x timesteps
+        *risk_perception_0* (float) : risk perception in t=0 (initial condition)
+    
+    Returns:
+        *risk_perception* (3D-array) : experiments x ResidentialArea x timesteps
+    """
+    flood_history = np.asarray(flood_history,dtype=float)
+    nearmiss_history = np.asarray(nearmiss_history,dtype=float)
+    risk_perception = np.full(flood_history.shape,np.nan)
+    risk_perception[...,0] = risk_perception_0
+    for a, RA in enumerate(Model.allResidentialArea):
+        if RA.name == 'Area_A': #For the Heijplaat
+            I_social = 0
+        elif RA.name == 'Area_B': #For the City Centre: account for risk perception in the Heijplaat
+            I_social = risk_perception[:,0,:]
+        else:
+            continue
+        risk_perception[:,a,:] = weigh_RP_Bayesian_array(RA.Bayesian_pars,flood_history[:,a,:],nearmiss_history[:,a,:],
+                                                         risk_perception_0,I_social)
+    return risk_perception
+
+def _weigh_RP_Bayesian_from(RA,start,I_social):
+    """
+    Apply ResidentialArea.weigh_RP_Bayesian from timestep start (but never in t=0) to the end of the run
+    
+    Arguments:
+        *RA* (ResidentialArea) : Residential area with time initiated as arrays
+        *start* (int) : first timestep to calculate
+        *I_social* (array) : Impact of neighbouring residential areas through media, per timestep
+    """
+    start = max(start,1) #the initial condition is used in the first timestep
+    n = len(RA.risk_perception)
+    a, b, c, I_exp = [x.tolist() for x in _Bayesian_coefficients(
+            RA.Bayesian_pars,RA.flood_history[start:n],RA.nearmiss_history[start:n])]
+    I_soc = I_social[start:n].tolist()
+    
+    risk_perception = float(RA.risk_perception[start-1])
+    result = [None] * (n-start)
+    for j in range(n-start):
+        risk_perception = (a[j] * risk_perception + b[j] * I_exp[j] + c[j] * I_soc[j]) / (a[j] + b[j] + c[j])
+        result[j] = risk_perception
+    RA.risk_perception[start:n] = result
+
+
+################################ BATCH OF EXPERIMENTS ########################################
+
+#Codes of the mayors which can be used in a Batch
+batch_mayors = list(mayor_classes(ThresholdMayor)) #mayors that can be used in a Batch (defined by a signal and thresholds)
+
+class Batch():
+    """
+    A batch of experiments with the same model (city), which are run in lockstep: 
+    all experiments are advanced one year at a time.
+    
+    Follows the same steps as run_model01 (and gives the same results when exact=True), but the 
+    state of all experiments is stored in NumPy arrays (experiments x areas x timesteps), and the 
+    decision rules of the mayors are applied as masked array updates.
+    
+    Arguments:
+        *Model* (Model object) : Model object describing the city
+        *surgelevel* (2D-array) : The extreme water level per experiment (rows) and timestep (columns)
+        *sealevel* (2D-array) : The sea level per experiment (rows) and timestep (columns)
+        *mayors* (list) : Mayor per experiment; either a code from batch_mayors (class name) or a Mayor object
+        *implementation_times* (list of tuples) : Implementation time of the small and large measures per experiment 
+        *exact* (bool) : if True, evaluate exp() and power() per element with the math module, 
+                         so that the results are identical to run_model01. If False, use the (faster)
+                         NumPy functions, which may differ in the last digit.
+    
+    Attributes (after running):
+        *protection_level*, *measure_history* (3D-arrays) : experiments x FloodProtection x timesteps
+        *event_history*, *flood_history*, *risk*, ... , *house_price_t_objective* (3D-arrays) : 
+            experiments x ResidentialArea x timesteps, same variables as the ResidentialArea objects
+    """
+    
+    def __init__(self,Model,surgelevel,sealevel,mayors,implementation_times,exact=True):
+        self.Model = Model
+        self.surgelevel = np.asarray(surgelevel,dtype=float)
+        self.sealevel = np.asarray(sealevel,dtype=float)
+        self.exact = exact
+        E, n = self.surgelevel.shape
+        if self.sealevel.shape != (E,n):
+            raise ValueError('sealevel has shape {}, expected {}'.format(self.sealevel.shape,(E,n)))
+        self.E, self.n = E, n
+        
+        #CODES OF THE MAYORS AND IMPLEMENTATION TIMES
+        codes = [mayor if isinstance(mayor,str) else type(mayor).__name__ for mayor in mayors]
+        available = mayor_classes(ThresholdMayor)
+        self.strategies = {} #code -> Mayor object, of which the signal and thresholds are used
+        for code, mayor in zip(codes,mayors):
+            if code not in available:
+                raise ValueError('Mayor {} can not be used in a Batch, choose from {}'.format(code,list(available)))
+            if code not in self.strategies:
+                self.strategies[code] = available[code]() if isinstance(mayor,str) else mayor
+        for code, strategy in self.strategies.items():
+            if strategy.flood_protection != 1:
+                raise ValueError('Mayor {} manages FloodProtection {}, in a Batch only 1 is possible'.format(code,strategy.flood_protection))
+        self.mayors = np.array(codes)
+        self.implementation_times = np.array(implementation_times,dtype=int).reshape(E,2)
+        
+        #THE SYNTHETIC EVENTS USED FOR THE RISK ASSESSMENT
+        self.mu = Model.Parameters["Gumbel"]["mu"]
+        self.beta = Model.Parameters["Gumbel"]["beta"]
+        self.Gumbel_table = Model.Gumbel_table(synthetic_RPs)
+        self.RPs = self.Gumbel_table.RPs_array
+        
+        #LINK THE AREAS WITH THE FLOOD PROTECTION
+        FP_names = [FP.name for FP in Model.allFloodProtection]
+        self.fp_index = [FP_names.index(RA.protected_by[0]) for RA in Model.allResidentialArea]
+        self.init_time()
+    
+    def init_time(self):
+        """
+        Initiate all variables that change over time, same as init_time() in run_model01
+        """
+        E, n = self.E, self.n
+        A = len(self.Model.allResidentialArea)
+        baseline = np.array([FP.baseline_level for FP in self.Model.allFloodProtection],dtype=float)
+        self.protection_level = np.repeat(baseline[np.newaxis,:,np.newaxis],E,axis=0).repeat(n,axis=2)
+        self.measure_history = np.zeros(self.protection_level.shape)
+        
+        self.event_history = np.full((E,A,n),"",dtype="<U1")
+        for attr in ['flood_history','nearmiss_history','flood_damage','risk','risk_household',
+                     'risk_household_perceived','risk_household_discounted','risk_household_discounted_perceived',
+                     'protection_level_rp','risk_perception','risk_perceived',
+                     'house_price_t_subjective','house_price_t_objective']:
+            setattr(self,attr,np.full((E,A,n),np.nan))
+        self.risk_perception[:,:,0] = 0
+        self.flood_proofing = np.zeros((E,A,n),dtype=bool)
+        
+        #THE ACTIVE MEASURE (IF ANY) OF EACH FLOODPROTECTION OBJECT, PER EXPERIMENT
+        F = len(self.Model.allFloodProtection)
+        self.active = np.zeros((E,F),dtype=bool)
+        self.active_heightening = np.zeros((E,F))
+        self.active_lead_time = np.zeros((E,F),dtype=int)
+        self.implementation_step = np.zeros((E,F),dtype=int) #timestep in which the active measure will be implemented
+        self.i = 0 #the next timestep to calculate
+    
+    def run(self,do_print=False):
+        "Run all timesteps of all experiments"
+        while self.i < self.n:
+            self.step()
+        self.discount()
+        if do_print:
+            print("Finished batch of {} experiments".format(self.E))
+        return self
+    
+    def step(self):
+        """
+        Advance all experiments one timestep
+        """
+        i = self.i
+        Model = self.Model
+        SL = self.surgelevel[:,i]
+        SLR = self.sealevel[:,i]
+        
+        for a, RA in enumerate(Model.allResidentialArea):
+            PL = self.protection_level[:,self.fp_index[a],i]
+            
+            #FIRST EVALUATE IF THE FLOOD PROTECTION LEVEL IS EXCEEDED
+            flood = PL < SL
+            overtopping = SL - PL
+            volume_attenuation_factor = np.where(overtopping < RA.volume_constraint_threshold,
+                                                 overtopping / RA.volume_constraint_threshold,1)
+            depth = (SL - RA.elevation) * volume_attenuation_factor
+            self.flood_history[flood,a,i] = depth[flood]
+            self.flood_damage[flood,a,i] = RA.damage_function.calculate_area(depth[flood],RA.surface_area,
+                                                                             self.flood_proofing[flood,a,i])
+            self.event_history[flood,a,i] = "~"
+            
+            #AND EVALUATE IF ANY NEAR MISS MIGHT HAVE OCCURED
+            freeboard = PL - SL
+            nearmiss = (0 < freeboard) & (freeboard <= 0.5)
+            self.nearmiss_history[nearmiss,a,i] = freeboard[nearmiss]
+            self.event_history[nearmiss,a,i] = "!"
+        
+        for a, RA in enumerate(Model.allResidentialArea):
+            PL = self.protection_level[:,self.fp_index[a],i]
+            flood_proofing = self.flood_proofing[:,a,i][:,np.newaxis]
+            
+            #CALCULATE THE OBJECTIVE RISK IN THE NEIGHBOURHOOD AND HOUSEHOLD IN THIS TIMESTEP 
+            protection_level_rp = self._Gumbel_RP(PL-SLR)
+            self.protection_level_rp[:,a,i] = protection_level_rp
+            waterlevels = self.Gumbel_table.waterlevels(SLR)
+            overtopping = waterlevels - PL[:,np.newaxis]
+            volume_attenuation_factor = np.where(overtopping < RA.volume_constraint_threshold,
+                                                 overtopping / RA.volume_constraint_threshold,1)
+            inundation = (waterlevels - RA.elevation) * volume_attenuation_factor
+            damages, damages_household = RA.damage_function.calculate(inundation,RA.surface_area,flood_proofing)
+            self.risk[:,a,i] = risk_FP_array(damages,self.RPs,protection_level_rp)*10**(-6)
+            self.risk_household[:,a,i] = risk_FP_array(damages_household,self.RPs,protection_level_rp)
+            
+            #CALCULATE THE RISK PERCEPTION
+            if i != 0: #skip in the first timestep (here the initial condition is used)
+                if RA.name == 'Area_A': #For the Heijplaat
+                    self._weigh_RP_Bayesian(a,RA,I_social=0)
+                elif RA.name == 'Area_B': #For the City Centre: account for risk perception in the Heijplaat
+                    self._weigh_RP_Bayesian(a,RA,I_social=self.risk_perception[:,0,i])
+            
+            return_periods = np.column_stack((np.broadcast_to(self.RPs,(self.E,len(self.RPs))),protection_level_rp))
+            perceived = shift_subjective_floods_array(return_periods,self.risk_perception[:,a,i],self.exact)
+            RPs_perceived, protection_level_rp_perceived = perceived[:,:-1], perceived[:,-1]
+            self.risk_perceived[:,a,i] = risk_FP_array(damages,RPs_perceived,protection_level_rp_perceived)*10**(-6)
+            self.risk_household_perceived[:,a,i] = risk_FP_array(damages_household,RPs_perceived,protection_level_rp_perceived)
+        
+        #IMPLEMENT FLOOD PROTECTION MEASURES
+        self._apply_strategies(i)
+        self._implement_measures(i)
+        self.i += 1
+    
+    def discount(self):
+        """
+        Discount the risk per household and calculate the house prices, for all timesteps 
+        with enough remaining time to discount over the house price horizon
+        (the mayors don't use these, so this can be done after running all timesteps)
+        """
+        for a, RA in enumerate(self.Model.allResidentialArea):
+            h = slice(0,max(0,self.n-RA.house_price_horizon))
+            discounted = discount_risk_array(self.risk_household[:,a,h],RA.r,RA.house_price_horizon)
+            discounted_perceived = discount_risk_array(self.risk_household_perceived[:,a,h],RA.r,RA.house_price_horizon)
+            self.risk_household_discounted[:,a,h] = discounted
+            self.risk_household_discounted_perceived[:,a,h] = discounted_perceived
+            self.house_price_t_objective[:,a,h] = RA.house_price_0 - (discounted - discounted[:,0:1])
+            self.house_price_t_subjective[:,a,h] = RA.house_price_0 - (discounted_perceived - discounted[:,0:1])
+    
+    def _Gumbel_RP(self,h):
+        "Gumbel_RP for an array of storm surge heights"
+        if self.exact:
+            return np.array([Gumbel_RP(x,self.mu,self.beta) for x in h.tolist()])
+        return self.Gumbel_table.return_period(h)
+    
+    def _weigh_RP_Bayesian(self,a,RA,I_social):
+        "ResidentialArea.weigh_RP_Bayesian for all experiments in timestep self.i"
+        i = self.i
+        a_, b_, c_, I_exp = _Bayesian_coefficients(RA.Bayesian_pars,self.flood_history[:,a,i],self.nearmiss_history[:,a,i])
+        self.risk_perception[:,a,i] = (a_ * self.risk_perception[:,a,i-1] + b_ * I_exp + c_ * I_social) / (a_ + b_ + c_)
+    
+    def _apply_strategies(self,i):
+        """
+        The decision rules of the mayors in mayors.py, for all experiments at once:
+        the signal and thresholds of each mayor (see mayors.ThresholdMayor) are applied to 
+        the experiments with that mayor
+        """
+        small = np.zeros(self.E,dtype=bool) #experiments in which the small measure is triggered
+        large = np.zeros(self.E,dtype=bool) #experiments in which the large measure is triggered
+        
+        for code, strategy in self.strategies.items():
+            m = self.mayors == code
+            trigger_small, trigger_large = strategy.triggers(getattr(self,strategy.signal)[:,strategy.area,i])
+            small |= m & trigger_small
+            large |= m & trigger_large
+            
+            #Some mayors (Economicus_HP_iter) also implement flood proofing
+            if strategy.proofing_area is not None:
+                proofing = m & (self.risk[:,strategy.proofing_area,i] > strategy.proofing_threshold)
+                self.flood_proofing[proofing,strategy.proofing_area,i:] = True
+        
+        self._plan_measures(small,i,heightening=0.5,lead_time=self.implementation_times[:,0])
+        self._plan_measures(large,i,heightening=1,lead_time=self.implementation_times[:,1])
+    
+    def _plan_measures(self,triggered,i,heightening,lead_time,fp=1):
+        """
+        Plan a new measure in the experiments where it is triggered, following the rules in mayors.py:
+         - if there is no active measure, the new measure is planned
+         - if the active measure is smaller, it is replaced by the new measure, 
+           with a bonus on the lead time for the years they were already working on the old measure
+        """
+        active = self.active[:,fp]
+        replace = triggered & active & (heightening > self.active_heightening[:,fp])
+        already_working_on_it = self.active_lead_time[:,fp] - (self.implementation_step[:,fp] - i) #lead time - time to implementation
+        bonus = np.maximum(0,np.round(already_working_on_it*measure_bonus_factor,0).astype(int))
+        
+        plan = (triggered & ~active) | replace
+        new_lead_time = np.where(replace,lead_time - bonus,lead_time)
+        self.active[plan,fp] = True
+        self.active_heightening[plan,fp] = heightening
+        self.active_lead_time[plan,fp] = new_lead_time[plan]
+        self.implementation_step[plan,fp] = i + new_lead_time[plan]
+        self.measure_history[plan,fp,i] = heightening
+    
+    def _implement_measures(self,i):
+        "RunContext.implement_measures for the active measures of all experiments"
+        due = self.implementation_step
+        if np.any(self.active & (due < i)):
+            raise ValueError('Somehow the time_to_implementation became negative in timestep {}'.format(i))
+        implement = self.active & (due == i)
+        for e, f in zip(*np.nonzero(implement)):
+            self.protection_level[e,f,i:] = self.protection_level[e,f,i] + self.active_heightening[e,f]
+        self.active[implement] = False
+
+def Batch_from_SurgeLevels(Model,SurgeLevels,Mayors,Implementation_times,exact=True):
+    """
+    Create a Batch from lists of SurgeLevel objects, Mayors and implementation times (one per experiment)
+    All SurgeLevels should cover the same years
+    
+    Returns:
+        *batch* (Batch) : not yet run, call batch.run()
+    """
+    n = len(SurgeLevels[0].years)
+    surgelevel = np.array([SL.surgelevel[0:n] for SL in SurgeLevels],dtype=float)
+    sealevel = np.array([SL.corresponding_SLR_Scenario.sealevel[0:n] for SL in SurgeLevels],dtype=float)
+    return Batch(Model,surgelevel,sealevel,Mayors,Implementation_times,exact=exact)
@@ -13,6 +13,9 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+from bisect import bisect_right
+from collections import deque
+
 from matplotlib import patches
 from matplotlib.collections import PatchCollection
 
@@ -33,6 +36,8 @@ class Metric():
         *self._margin* (int) : margin around window to search for stable states, not meant to be altered
         *self.allSETPs_cands* (list) : list of SETP-objects in metric
         *self.stable_states* (list) : all stable states in metric
+        *self.state_index* (StateIndex) : means of the stable states and lookup of states per year
+        *self.first_duplicate*, *self.duplicate_of* (int arrays) : duplicates among the candidates, see duplicate_groups
     """
     
     def __init__(self,index,data,name=None):
@@ -161,16 +166,20 @@ class Metric():
         #The self.candidates originates from the select_candidates functions, TODO: this should be done by this function
         self.stable_states = find_states(df['stable'],self._window,2.0) #returns begin and end years of stable states
 
+        #Summary of the stable states (means, years), to look up the states around each SETP
+        self.state_index = StateIndex(self.stable_states,self.statistics.iloc[:,0])
+
         #Adds stable state before and after the SETP to the SETP object
         for cand in self.allSETPs_cands:
-            before, after = find_window_around_point(cand.year,self.stable_states,
+            before, after = find_window_around_point(cand.year,self.state_index,
                                                      window_size=self._window,margin=self._margin,index=True)    
             #before and after are the indices of the states before and after; or None
             cand.before = before
             cand.after = after    
 
         #Add information on duplicates (if any)
-        self.allSETPs_cands = identify_duplicates(self.allSETPs_cands)
+        self.first_duplicate, self.duplicate_of = duplicate_groups(self.allSETPs_cands)
+        self.allSETPs_cands = identify_duplicates(self.allSETPs_cands,duplicate_of=self.duplicate_of)
 
         #If the window before equals the window after, set SETP type at 'sw' = 'same_window'
         for i, cand in enumerate(self.allSETPs_cands):
@@ -202,11 +211,8 @@ class Metric():
         for i, cand in enumerate(self.allSETPs_cands):
             if cand.Type == 'real': #only check for the ones that meet C1 and C2
 
-                timeseries = self.statistics.iloc[:,0]
-                mean_of_states_dict, as_df = mean_of_states(self.stable_states, timeseries)
-
-                mean_state_before = mean_of_states_dict[cand.before]
-                mean_state_after = mean_of_states_dict[cand.after]
+                mean_state_before = self.state_index.means[cand.before]
+                mean_state_after = self.state_index.means[cand.after]
                 difference = mean_state_after - mean_state_before
                 if not mean_state_before == 0:
                     perc_diff = 100 * abs(difference / mean_state_before)
@@ -245,38 +251,8 @@ class Metric():
         
         """
         
-        sel_cands = [setp for setp in self.allSETPs_cands if setp.sign == sign]
-
-        selected_examples_years = [setp.year for setp in sel_cands if setp.Type == 'real' and setp.duptype != 'dup']
-        duplicates_years = [setp.year for setp in sel_cands if setp.duptype == 'dup']
-        only_after = [setp.year for setp in sel_cands if setp.Type == 'oa']
-        only_before = [setp.year for setp in sel_cands if setp.Type == 'ob']
-        same_window = [setp.year for setp in sel_cands if setp.Type == 'sw']
-        not_before_not_after = [setp.year for setp in sel_cands if setp.Type == 'no']
-        unsubstantial = [setp.year for setp in sel_cands if setp.Type == 'us']
-
-
-        #MANUALLY ADD THE POSITIVE SETPS IF THEY HAVE A NEGATIVE DUPLICATE
-        additions = [] #save the ones that are still relevant
-        positives = [setp for setp in self.allSETPs_cands if setp.sign == 1 and setp.duptype == 'dup_first']
-        #the above are positives with duplicates (these duplicates might be negative, so still relevant)
-        for positive in positives:
-            n = 0
-            for duplicate_year in positive.dups_with:
-                duplicate = [setp for setp in self.allSETPs_cands if setp.year == duplicate_year][0]
-                if duplicate.sign == sign and duplicate.Type == 'real':
-                    if n < 1: #make sure only the first one is added
-                        additions.append(duplicate) #but not all, only the first!
-                        n += 1
-
-        for setp in additions:
-            selected_examples_years.append(setp.year)
-            
-        self.selected_SETPs = selected_examples_years[:]
-        
-        #Todo: save as a dict
-        self.candidates_as_lists = (self.selected_SETPs,duplicates_years,only_after,
-                only_before,same_window,not_before_not_after,unsubstantial)
+        self.candidates_as_lists = select_from_candidates(self.allSETPs_cands,sign)
+        self.selected_SETPs = self.candidates_as_lists[0]
         
     def plot_SETPs(self,**kwargs):
         """
@@ -419,6 +395,71 @@ class Metric():
             
         return fig,ax
 
+def select_from_candidates(allSETPs_cands,sign):
+    """
+    Select a subgroup of SETPs from classified SETP candidates (see Metric.select_SETPs)
+    
+    Arguments:
+        *allSETPs_cands* (list of SETP objects) : classified candidates, as Metric.allSETPs_cands
+        *sign* (int) : -1 or 1, indicating positive or negative 'rapid changes'
+    
+    Returns:
+        *candidates_as_lists* (tuple of lists of years) : (selected_SETPs, duplicates, only_after,
+                              only_before, same_window, not_before_not_after, unsubstantial)
+    """
+    sel_cands = [setp for setp in allSETPs_cands if setp.sign == sign]
+
+    selected_examples_years = [setp.year for setp in sel_cands if setp.Type == 'real' and setp.duptype != 'dup']
+    duplicates_years = [setp.year for setp in sel_cands if setp.duptype == 'dup']
+    only_after = [setp.year for setp in sel_cands if setp.Type == 'oa']
+    only_before = [setp.year for setp in sel_cands if setp.Type == 'ob']
+    same_window = [setp.year for setp in sel_cands if setp.Type == 'sw']
+    not_before_not_after = [setp.year for setp in sel_cands if setp.Type == 'no']
+    unsubstantial = [setp.year for setp in sel_cands if setp.Type == 'us']
+
+
+    #MANUALLY ADD THE POSITIVE SETPS IF THEY HAVE A NEGATIVE DUPLICATE
+    additions = [] #save the ones that are still relevant
+    positives = [setp for setp in allSETPs_cands if setp.sign == 1 and setp.duptype == 'dup_first']
+    #the above are positives with duplicates (these duplicates might be negative, so still relevant)
+    by_year = {} #first candidate in each year
+    for setp in allSETPs_cands:
+        by_year.setdefault(setp.year,setp)
+    for positive in positives:
+        for duplicate_year in positive.dups_with:
+            duplicate = by_year[duplicate_year]
+            if duplicate.sign == sign and duplicate.Type == 'real':
+                additions.append(duplicate) #but not all, only the first!
+                break
+
+    for setp in additions:
+        selected_examples_years.append(setp.year)
+        
+    #Todo: save as a dict
+    return (selected_examples_years[:],duplicates_years,only_after,
+            only_before,same_window,not_before_not_after,unsubstantial)
+
+def find_first_SETP(candidates_as_lists):
+    """
+    The first SETP: the first selected SETP or the first candidate that is only stable before 
+    the rapid change (type 'ob'), whichever comes first
+    
+    Arguments:
+        *candidates_as_lists* (tuple) : as returned by select_from_candidates / Metric.candidates_as_lists
+    
+    Returns:
+        *first_SETP* (int) : year, None if there is no SETP
+    """
+    selected_SETPs, only_before = candidates_as_lists[0], candidates_as_lists[3]
+    if not len(selected_SETPs) == 0: #only if it has any SETPs
+        first_real = selected_SETPs[0] #the first real tipping point
+        if not len(only_before) == 0: #only if any of these exist
+            return min(first_real,only_before[0])
+        return first_real #only the 'real tipping point list' has items
+    elif not len(only_before) == 0: #but there is an example of 'only stable before'
+        return only_before[0]
+    return None #both types do not exist
+
 class SETP():
     "A socio-economic tipping point candidate"
     
@@ -467,13 +508,39 @@ def average_before_after(data,year,window,margin):
     after = data.loc[year+margin:year+margin+window].mean()
     return(before,after)
 
-def identify_duplicates(candidate_SETPs):
+def duplicate_groups(candidate_SETPs):
+    """Group the SETP candidates that describe the same shift from state A to state B
+    (the same state before and after), using a hash table instead of comparing all pairs
+    
+    Arguments:
+        *candidate_SETPs* (list of SETP objects) : with before and after set
+    
+    Returns:
+        *first_duplicate* (int array) : for each candidate, the position of the first candidate 
+                                        with the same states, -1 if there are no duplicates
+        *duplicate_of* (int array) : for each duplicate that is not the first, the position of 
+                                     the first candidate with the same states, otherwise -1
+    """
+    n = len(candidate_SETPs)
+    first_duplicate = np.full(n,-1)
+    duplicate_of = np.full(n,-1)
+    groups = {} #(before, after) -> positions
+    for position, setp in enumerate(candidate_SETPs):
+        groups.setdefault((setp.before,setp.after),[]).append(position)
+    for positions in groups.values():
+        if len(positions) > 1:
+            first_duplicate[positions] = positions[0]
+            duplicate_of[positions[1:]] = positions[0]
+    return first_duplicate, duplicate_of
+
+def identify_duplicates(candidate_SETPs,duplicate_of=None):
     """Identify duplicates in a list of SETP candidates
     Duplicate is a pair of SETPs that describe the same
     shift from state A to state B
     
     Arguments:
         *candidate_SETPs* (list of SETP objects)
+        *duplicate_of* (int array) : (optional) as returned by duplicate_groups, calculated if not provided
     
     Returns: 
         *candidate_SETPs* (list of SETP objects)
@@ -491,19 +558,79 @@ def identify_duplicates(candidate_SETPs):
     
     """
     setps = [s for s in candidate_SETPs]
+    if duplicate_of is None:
+        duplicate_of = duplicate_groups(setps)[1]
     
-    for i,setp_i in enumerate(setps):
-        for setp_j in setps[i+1::]:
-                if setp_i.before == setp_j.before and setp_i.after == setp_j.after: #duplicate!
-                    if not setp_i.duptype == 'dup': # is not already a dup of an earlier setp itself
-                        setp_i.duptype = 'dup_first'
-                        if hasattr(setp_i,'dups_with'):
-                            setp_i.dups_with.append(setp_j.year) #already has a list with dups
-                        else:
-                            setp_i.dups_with = [setp_j.year] #create a dups_with list  
-                    setp_j.duptype = 'dup'
+    for j in np.flatnonzero(duplicate_of >= 0): #in the order of the candidates
+        setp_i = setps[duplicate_of[j]] #first of the duplicates
+        setp_j = setps[j]
+        if not setp_i.duptype == 'dup': # is not already a dup of an earlier setp itself
+            setp_i.duptype = 'dup_first'
+            if hasattr(setp_i,'dups_with'):
+                setp_i.dups_with.append(setp_j.year) #already has a list with dups
+            else:
+                setp_i.dups_with = [setp_j.year] #create a dups_with list  
+        setp_j.duptype = 'dup'
     return setps
 
+class StateIndex():
+    """
+    Summary of the stable states of a metric, calculated once per metric
+    
+    Contains the mean of each state, and a table with the (last) state that contains each year,
+    so that the state around a year is found without searching all states.
+    
+    Arguments:
+        *states* (list of tuples) : (start_year,end_year), as returned by find_states
+        *series* (Pandas Series) : the variable of interest to take the mean over (index=year)
+    """
+    def __init__(self,states,series):
+        self.states = states
+        self.means = [series.loc[state[0]:state[1]].mean() for state in states]
+        if len(states) > 0:
+            self.first_year = min(state[0] for state in states)
+            last_year = max(state[1] for state in states)
+            self.table = np.full(last_year - self.first_year + 1,-1)
+            for i, state in enumerate(states): #if states overlap, the last one is used (as in find_window_around_point)
+                self.table[state[0]-self.first_year:state[1]-self.first_year+1] = i
+        else:
+            self.first_year = 0
+            self.table = np.full(0,-1)
+        self.index = series.index
+    
+    def __len__(self):
+        return len(self.states)
+    
+    def span(self,i):
+        "Start and end year of state i"
+        return self.states[i]
+    
+    def state_at(self,year):
+        """
+        Returns:
+            *i* (int) : index of the (last) state that contains the year, None if no state contains it
+        """
+        position = year - self.first_year
+        if 0 <= position < len(self.table) and self.table[position] >= 0:
+            return int(self.table[position])
+        return None
+    
+    def around(self,point,margin,index=True):
+        "States before and after a point, see find_window_around_point"
+        before = self.state_at(point - margin)
+        after = self.state_at(point + margin)
+        if not index:
+            before = self.states[before] if before is not None else None
+            after = self.states[after] if after is not None else None
+        return before, after
+    
+    def as_series(self):
+        "The mean of the state in each year (index=year), NaN for years outside states"
+        mean_of_states = pd.Series(index=self.index,dtype='float64')
+        for i, state in enumerate(self.states):
+            mean_of_states.loc[state[0]:state[1]] = self.means[i]
+        return mean_of_states
+    
 def mean_of_states(states,series):
     """
     For each state, calculate the mean of the values in 
@@ -514,17 +641,12 @@ def mean_of_states(states,series):
         *series* (Pandas Series) : the variable of interest to take the mean over (index=year)
         
     Returns:
+        *asdict* (dict) : the mean of each state (key=index of the state)
         *mean_of_state* (Pandas Series) : (index=year), the means over each state
     """
-    mean_of_states = pd.Series(index=series.index,dtype='float64')
-    asdict = {}
-    for i, state in enumerate(states):
-        selection = series.loc[state[0]:state[1]]
-        mean = selection.mean()
-        asdict[i] = mean
-        for j in range(state[0],state[1]+1):
-            mean_of_states.at[j] = mean
-    return asdict, mean_of_states
+    state_index = StateIndex(states,series)
+    asdict = dict(enumerate(state_index.means))
+    return asdict, state_index.as_series()
 
 def find_states(sample,window,findvalue):
     """
@@ -570,7 +692,8 @@ def find_window_around_point(point, windows, window_size, margin, index=True):
 
     Arguments:
         *point* (int) : the year of interest
-        *windows* (list of tuples): list of tuples with (begin, end) year of stable state
+        *windows* (list of tuples or StateIndex): list of tuples with (begin, end) year of stable state
+                    ... a StateIndex finds the states without iterating over all windows
         *window_size* (int) : indicate the length of thewindow (unused)
         *margin* (int) : the number of distances one should look around the point for stable states
 
@@ -578,6 +701,8 @@ def find_window_around_point(point, windows, window_size, margin, index=True):
      e.g. (4,5) (state before is 4, state after is nr 5)
      e.g. (None,6) (No state before, state after is nr 6)
     """
+    if isinstance(windows,StateIndex):
+        return windows.around(point,margin,index=index)
 
     before = None
     after = None
@@ -598,6 +723,526 @@ def find_window_around_point(point, windows, window_size, margin, index=True):
 
     return before, after
 
+################################ ARRAY VERSION ########################################
+
+class SETPArrays():
+    """
+    SETP candidates and stable states of many metrics, as created by find_SETPs_array()
+    
+    Candidates are stored in the same order as Metric.allSETPs_cands (by metric, then by year),
+    stable states in the same order as Metric.stable_states.
+    
+    Attributes (one value per candidate):
+        *cand_metric* (int array) : row of the metric
+        *cand_year* (int array) : year of the rapid change
+        *cand_sign* (int array) : -1 or 1
+        *cand_before*, *cand_after* (int arrays) : index of the state before/after (as in SETP.before), -1 if None
+        *cand_Type* (str array) : SETP.Type
+        *cand_duptype* (str array) : SETP.duptype, '' if None
+        *cand_dup_of* (int array) : for duptype 'dup': position of the 'dup_first' candidate, otherwise -1
+        
+    Attributes (one value per stable state):
+        *state_metric* (int array) : row of the metric
+        *state_start*, *state_end* (int arrays) : first and last year of the state
+        *state_mean* (float array) : mean of the metric in the state
+        *state_offset* (int array) : position of the first state of each metric (length n_metrics + 1)
+    """
+    def __init__(self,n_metrics,**arrays):
+        self.n_metrics = n_metrics
+        for key, value in arrays.items():
+            setattr(self,key,value)
+    
+    def __repr__(self):
+        return "SETPArrays: {} metrics, {} candidates, {} stable states".format(
+            self.n_metrics,len(self.cand_year),len(self.state_start))
+    
+    def stable_states(self,m):
+        "Stable states of metric m, as Metric.stable_states"
+        sel = slice(self.state_offset[m],self.state_offset[m+1])
+        return list(zip(self.state_start[sel].tolist(),self.state_end[sel].tolist()))
+    
+    def candidates(self,m):
+        "SETP candidates of metric m, as Metric.allSETPs_cands"
+        positions = np.flatnonzero(self.cand_metric == m)
+        cands = {}
+        for c in positions:
+            setp = SETP(int(self.cand_year[c]),int(self.cand_sign[c]))
+            setp.before = int(self.cand_before[c]) if self.cand_before[c] >= 0 else None
+            setp.after = int(self.cand_after[c]) if self.cand_after[c] >= 0 else None
+            setp.Type = str(self.cand_Type[c])
+            setp.duptype = str(self.cand_duptype[c]) if self.cand_duptype[c] != '' else None
+            if self.cand_dup_of[c] >= 0:
+                first = cands[self.cand_dup_of[c]]
+                first.dups_with = getattr(first,'dups_with',[]) + [setp.year]
+            cands[c] = setp
+        return list(cands.values())
+    
+    def _first_main(self,sign):
+        "Per metric, position of the first 'real' candidate of this sign that is not a 'dup' (-1 if None)"
+        return self._first_per_metric((self.cand_sign == sign) & (self.cand_Type == 'real') & (self.cand_duptype != 'dup'))
+    
+    def _additions(self,sign):
+        """
+        Candidates added by Metric.select_SETPs because they are a duplicate of a positive candidate:
+        mask and sort key (the order in which they are added)
+        """
+        first = np.where(self.cand_dup_of >= 0,self.cand_dup_of,0)
+        mask = ((self.cand_dup_of >= 0) & (self.cand_sign == sign) & (self.cand_Type == 'real') &
+                (self.cand_sign[first] == 1)) #the 'dup_first' is positive
+        #only the first duplicate of each positive is added, in the order of the positives
+        key = first * len(self.cand_year) + np.arange(len(self.cand_year))
+        return mask, key
+    
+    def _first_per_metric(self,mask,key=None):
+        "Per metric, the position of the candidate in mask with the lowest key (default: the first), -1 if None"
+        n = len(self.cand_year)
+        if key is None:
+            key = np.arange(n)
+        best = np.full(self.n_metrics,np.iinfo(np.int64).max,dtype=np.int64)
+        np.minimum.at(best,self.cand_metric[mask],key[mask])
+        found = best != np.iinfo(np.int64).max
+        return np.where(found,best % max(n,1),-1)
+    
+    def _year_of(self,positions):
+        "Year of the candidates at positions, -1 for position -1"
+        if len(self.cand_year) == 0:
+            return np.full(len(positions),-1,dtype=np.int64)
+        return np.where(positions >= 0,self.cand_year[np.maximum(positions,0)],-1)
+    
+    def selected_SETPs(self,m,sign):
+        "Years of the selected SETPs of metric m, as Metric.selected_SETPs after Metric.select_SETPs(sign)"
+        in_m = self.cand_metric == m
+        main = in_m & (self.cand_sign == sign) & (self.cand_Type == 'real') & (self.cand_duptype != 'dup')
+        years = self.cand_year[main].tolist()
+        mask, key = self._additions(sign)
+        added = np.flatnonzero(mask & in_m) #in the order of the candidates
+        added = added[np.unique(self.cand_dup_of[added],return_index=True)[1]] #first one per positive, in order of the positives
+        return years + self.cand_year[added].tolist()
+    
+    def first_SETP(self,sign):
+        """
+        Year of the first SETP of each metric: the first selected SETP or the first candidate that is only 
+        stable before the rapid change (type 'ob'), whichever comes first (as in run_model_workbench)
+        
+        Arguments:
+            *sign* (int) : -1 or 1, see Metric.select_SETPs
+        
+        Returns:
+            *first_SETP* (int array) : year per metric, -1 if there is no SETP
+        """
+        first = self._first_main(sign)
+        mask, key = self._additions(sign)
+        addition = self._first_per_metric(mask,key)
+        first_year = self._year_of(np.where(first >= 0,first,addition))
+        ob_year = self._year_of(self._first_per_metric((self.cand_sign == sign) & (self.cand_Type == 'ob')))
+        both = (first_year >= 0) & (ob_year >= 0)
+        return np.where(both,np.minimum(first_year,ob_year),np.maximum(first_year,ob_year))
+
+
+def rolling_variance(values,window):
+    """
+    Variance (ddof=1) in a rolling window over the rows of a 2D array, result at the right edge of the window
+    (same as pandas Series.rolling(window).var(), up to rounding differences)
+    
+    Arguments:
+        *values* (2D array) : metrics x time
+        *window* (int) : width of the window
+    
+    Returns:
+        *variance* (2D array) : NaN for the first window-1 columns and for windows with NaN values
+    """
+    variance = np.full(values.shape,np.nan)
+    if values.shape[1] >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values,window,axis=1)
+        mean = windows.mean(axis=-1)
+        variance[:,window-1:] = ((windows - mean[...,None])**2).sum(axis=-1) / (window - 1)
+    return variance
+
+
+def find_SETPs_array(data,years,window,c1,c2,c3,margin):
+    """
+    Find the SETP candidates of many metrics at once, with the same results as calling 
+    Metric.create_statistics(window) and Metric.find_SETP_candidates(c1,c2,c3,margin) for each metric
+    
+    Arguments:
+        *data* (2D array or list of lists) : metrics x time, e.g. house prices over time 
+        *years* (list of ints) : consecutive years corresponding to the columns of data
+        *window* (int) : size of the rolling window
+        *c1*, *c2*, *c3*, *margin* : tipping point criteria, see Metric.find_SETP_candidates
+    
+    Returns:
+        *result* (SETPArrays object)
+    
+    NOTE: the rolling variance is calculated directly from the values in each window, which can
+    differ by rounding from the online algorithm of pandas. Where this could change the outcome of 
+    criterion C2, the variance is recalculated with pandas, so the results are identical.
+    """
+    values = np.array(data,dtype=float,ndmin=2)
+    values[values < 0] = 0 #same as Metric: avoid values below zero
+    years = np.asarray(years,dtype=np.int64)
+    M, T = values.shape
+    if len(years) != T or (T > 1 and np.any(np.diff(years) != 1)):
+        raise ValueError('years should be consecutive and correspond to the columns of data')
+    
+    # CRITERION 1: RAPID CHANGE (in the order of Metric.allSETPs_cands: by metric, then by year)
+    derivative = np.full((M,T),np.nan)
+    derivative[:,1:] = values[:,1:] - values[:,:-1]
+    house_price_t0 = values[:,:1]
+    negative = derivative <= -c1 * house_price_t0
+    positive = derivative >= +c1 * house_price_t0
+    cand_metric, cand_col = np.nonzero(negative | positive)
+    cand_year = years[cand_col]
+    cand_sign = np.where(negative[cand_metric,cand_col],-1,1)
+    
+    # CRITERION 2: STABLE STATES
+    variance = rolling_variance(values,window)
+    near = np.abs(variance - c2) <= 1e-9 * abs(c2) #rounding could matter: use pandas
+    for m in np.flatnonzero(near.any(axis=1)):
+        variance[m] = pd.Series(values[m]).rolling(window=window).var().to_numpy()
+    stable = variance < c2
+    #states start where stable begins and end where it stops; states that do not end are ignored (see find_states)
+    previous = np.zeros((M,T),dtype=bool)
+    previous[:,1:] = stable[:,:-1]
+    following = np.zeros((M,T),dtype=bool)
+    following[:,:-1] = stable[:,1:]
+    start_metric, start_col = np.nonzero(stable & ~previous)
+    end_col = np.nonzero(stable & ~following)[1]
+    closed = end_col < T - 1
+    state_metric = start_metric[closed]
+    state_start = years[start_col[closed]] - window + 1
+    state_end = years[end_col[closed]]
+    state_offset = np.searchsorted(state_metric,np.arange(M+1))
+    
+    #mean of the metric in each state (as Series.loc[start:end].mean(): skipping NaN)
+    state_mean = np.empty(len(state_start))
+    for k, (m, start, end) in enumerate(zip(state_metric,state_start,state_end)):
+        selection = values[m,max(start-years[0],0):end-years[0]+1]
+        valid = ~np.isnan(selection)
+        state_mean[k] = np.where(valid,selection,0).sum() / valid.sum() if valid.any() else np.nan
+    
+    #states around each candidate: the last state that contains year -/+ margin (see find_window_around_point)
+    offset = years[0] - window - margin - 1 #keys are positive
+    span = T + 2 * (window + margin + 1)
+    state_key = state_metric * span + (state_start - offset)
+    def state_around(year):
+        k = np.searchsorted(state_key,cand_metric * span + (year - offset),side='right') - 1
+        kk = np.maximum(k,0)
+        found = (k >= 0) & (state_metric[kk] == cand_metric) & (state_end[kk] >= year) if len(state_key) else np.zeros(len(k),dtype=bool)
+        return np.where(found,k - state_offset[cand_metric],-1)
+    cand_before = state_around(cand_year - margin)
+    cand_after = state_around(cand_year + margin)
+    
+    #duplicates: candidates of the same metric with the same state before and after
+    n_keys = (state_offset[1:] - state_offset[:-1]).max(initial=0) + 2
+    group_key = (cand_metric * n_keys + cand_before + 1) * n_keys + cand_after + 1
+    _, first, inverse, counts = np.unique(group_key,return_index=True,return_inverse=True,return_counts=True)
+    first_of_group = first[inverse]
+    in_group = counts[inverse] > 1
+    position = np.arange(len(cand_year))
+    cand_duptype = np.where(in_group,np.where(position == first_of_group,'dup_first','dup'),'')
+    cand_dup_of = np.where(in_group & (position != first_of_group),first_of_group,-1)
+    
+    #classification
+    cand_Type = np.where(cand_before >= 0,np.where(cand_after >= 0,'real','ob'),
+                         np.where(cand_after >= 0,'oa','no')).astype('<U4')
+    cand_Type[cand_before == cand_after] = 'sw'
+    
+    # CRITERION 3: SUBSTANTIALLY DIFFERENT STATES
+    real = np.flatnonzero(cand_Type == 'real')
+    mean_before = state_mean[state_offset[cand_metric[real]] + cand_before[real]]
+    mean_after = state_mean[state_offset[cand_metric[real]] + cand_after[real]]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        perc_diff = 100 * np.abs((mean_after - mean_before) / mean_before)
+    cand_Type[real[(mean_before != 0) & (perc_diff <= c3)]] = 'us'
+    cand_Type[real[mean_before == 0]] = 'zd'
+    
+    return SETPArrays(M,cand_metric=cand_metric,cand_year=cand_year,cand_sign=cand_sign,
+                      cand_before=cand_before,cand_after=cand_after,cand_Type=cand_Type,
+                      cand_duptype=cand_duptype,cand_dup_of=cand_dup_of,
+                      state_metric=state_metric,state_start=state_start,state_end=state_end,
+                      state_mean=state_mean,state_offset=state_offset)
+
+
+################################ STREAMING VERSION ########################################
+
+class RollingVariance():
+    """
+    Variance of a rolling window, updated in O(1) when a value enters or leaves the window
+    
+    Follows the online algorithm of pandas (Welford's method with Kahan summation, and a variance 
+    of 0 for a window of equal values), so var() is identical to Series.rolling(window).var() 
+    when the same values are added and removed. NaN values are skipped, as in pandas.
+    """
+    def __init__(self):
+        self.nobs = 0
+        self._mean = 0.
+        self._ssqdm = 0. #sum of squared differences from the mean
+        self._compensation_add = 0.
+        self._compensation_remove = 0.
+        self._same = 0 #number of consecutive equal values
+        self._previous = None
+    
+    def add(self,value):
+        if self._previous is None: #as pandas: the first value counts as equal to the previous one
+            self._previous = value
+        if value != value: #NaN
+            return
+        self.nobs += 1
+        self._same = self._same + 1 if value == self._previous else 1
+        self._previous = value
+        previous_mean = self._mean - self._compensation_add
+        y = value - self._compensation_add
+        t = y - self._mean
+        self._compensation_add = t + self._mean - y
+        self._mean = self._mean + t / self.nobs
+        self._ssqdm = self._ssqdm + (value - previous_mean) * (value - self._mean)
+    
+    def remove(self,value):
+        if value != value: #NaN
+            return
+        self.nobs -= 1
+        if self.nobs:
+            previous_mean = self._mean - self._compensation_remove
+            y = value - self._compensation_remove
+            t = y - self._mean
+            self._compensation_remove = t + self._mean - y
+            self._mean = self._mean - t / self.nobs
+            self._ssqdm = self._ssqdm - (value - previous_mean) * (value - self._mean)
+        else:
+            self._mean = 0.
+            self._ssqdm = 0.
+    
+    def mean(self):
+        return self._mean if self.nobs else float('nan')
+    
+    def var(self,min_periods=1,ddof=1):
+        "Sample variance of the values in the window, NaN if there are less than min_periods (non-NaN) values"
+        if self.nobs < max(min_periods,1) or self.nobs <= ddof:
+            return float('nan')
+        if self.nobs == 1 or self._same >= self.nobs:
+            return 0.
+        return self._ssqdm / (self.nobs - ddof)
+
+
+class SETPDetector():
+    """
+    Incremental version of the tipping point analysis of a Metric, which receives the metric one 
+    value per year (e.g. from the model loop, see run_model01) instead of analysing the finished time series
+    
+    It only keeps the values of the last window and of the stable state that is not yet closed. 
+    The rolling variance is updated in O(1) per year, with the same online algorithm as pandas 
+    (Welford's method with Kahan summation, see RollingVariance), so it is identical to Series.rolling().var().
+    Stable states are closed as soon as the variance exceeds the threshold, and each SETP candidate
+    is classified as soon as the states around it can no longer change. After finish(), the candidates, states and selection
+    are the same as those of Metric.create_statistics(window), Metric.find_SETP_candidates(c1,c2,c3,margin)
+    and Metric.select_SETPs(sign).
+    
+    If only the first SETP is needed, the run can be stopped as soon as self.done is True.
+    
+    Arguments:
+        *name* (string) : name of the metric
+        *startyear* (int) : year of the first value, the following values are for consecutive years
+        *window*, *c1*, *c2*, *c3*, *margin* : tipping point criteria, see Metric.find_SETP_candidates
+        *sign* (int) : -1 or 1, the sign of the SETPs to select (see Metric.select_SETPs)
+        
+    Attributes:
+        *n* (int) : the number of values received so far (values below 0 are set to 0)
+        *stable_states* (list of tuples) : the (closed) stable states found so far
+        *allSETPs_cands* (list of SETP objects) : the classified candidates so far
+        *done* (bool) : if first_SETP is known (it can not change by receiving more values)
+        *first_SETP* (int) : year of the first SETP (see find_first_SETP), None if there is none (yet)
+    """
+    def __init__(self,name,startyear,window,c1,c2,c3,margin,sign=-1):
+        self.name = name
+        self.startyear = startyear
+        self._window = window
+        self._margin = margin
+        self.c1, self.c2, self.c3 = c1, c2, c3
+        self.sign = sign
+        
+        self.n = 0
+        self._first = None #first value (criterion 1 is relative to it)
+        self._previous = None
+        self._last = deque(maxlen=window) #values of the last window
+        self._rolling = RollingVariance()
+        self._state_values = [] #values from the first year of the stable state that is not yet closed
+        self.window_mean = float('nan') #statistics of the last window
+        self.window_variance = float('nan')
+        self.stable_states = []
+        self.state_means = []
+        self._state_starts = [] #first year of each state, to find states by year
+        self._run_start = None #first year of the stable state that is not yet closed
+        self._pending = deque() #candidates that can not be classified yet
+        self._groups = {} #(before, after) -> first candidate with these states
+        self.allSETPs_cands = []
+        
+        self._first_main = None #first selected candidate that is not an addition
+        self._first_ob = None
+        self._additions = False #if any candidate could be selected as addition (see select_from_candidates)
+        self.first_SETP = None
+        self.done = False
+        self.finished = False
+    
+    def __repr__(self):
+        return "SETPDetector {} ({} values)".format(self.name,self.n)
+    
+    def update(self,value):
+        """
+        Add the value of the metric in the next year
+        
+        Returns:
+            *events* (list of tuples) : ('state', (start,end)) for each stable state that was closed,
+                                        ('SETP', SETP object) for each candidate that was classified
+        """
+        t = self.n
+        year = self.startyear + t
+        window = self._window
+        if value < 0: #same as Metric: avoid values below zero
+            value = 0
+        self.n += 1
+        
+        #CRITERION 1: RAPID CHANGE
+        if t == 0:
+            self._first = value
+        else:
+            change = value - self._previous
+            house_price_t0 = self._first
+            if change <= -self.c1 * house_price_t0:
+                self._pending.append(SETP(year,-1))
+            elif change >= +self.c1 * house_price_t0:
+                self._pending.append(SETP(year,1))
+        self._previous = value
+        
+        #CRITERION 2: STABLE STATES (rolling statistics of the last window)
+        if len(self._last) == window:
+            self._rolling.remove(self._last[0])
+        self._last.append(value)
+        self._rolling.add(value)
+        if self._run_start is not None:
+            self._state_values.append(value)
+        events = []
+        if t >= window - 1:
+            self.window_mean = self._rolling.mean()
+            self.window_variance = self._rolling.var(min_periods=window)
+        stable = self.window_variance < self.c2
+        if stable and self._run_start is None:
+            self._run_start = year - window + 1 #the state starts at the first year of the first stable window
+            self._state_values = list(self._last)
+        elif not stable and self._run_start is not None:
+            events.append(('state',self._close_state(year - 1)))
+        
+        events.extend(('SETP',setp) for setp in self._classify(year))
+        return events
+    
+    def finish(self):
+        """
+        End of the time series: states that are not closed are ignored (see find_states), 
+        all remaining candidates are classified and the first SETP is final
+        
+        Returns:
+            *events* (list of tuples) : see update()
+        """
+        self._run_start = None
+        self._state_values = []
+        events = [('SETP',setp) for setp in self._classify(None)]
+        self.candidates_as_lists = select_from_candidates(self.allSETPs_cands,self.sign)
+        self.selected_SETPs = self.candidates_as_lists[0]
+        self.first_SETP = find_first_SETP(self.candidates_as_lists)
+        self.done = True
+        self.finished = True
+        return events
+    
+    def _close_state(self,end):
+        start = self._run_start
+        selection = np.array(self._state_values[:end-start+1],dtype=float)
+        valid = ~np.isnan(selection)
+        #mean as Series.mean(): NumPy sum, skipping NaN
+        self.state_means.append(np.where(valid,selection,0).sum() / valid.sum() if valid.any() else float('nan'))
+        self.stable_states.append((start,end))
+        self._state_starts.append(start)
+        self._run_start = None
+        self._state_values = []
+        return (start,end)
+    
+    def _state_at(self,year):
+        "Index of the last closed state that contains the year (as find_window_around_point), None if none"
+        i = bisect_right(self._state_starts,year) - 1 #last state starting before the year (later states end later)
+        if i >= 0 and self.stable_states[i][1] >= year:
+            return i
+        return None
+    
+    def _final(self,year,now):
+        """
+        If the states that contain a year can no longer change: states starting later start after 
+        the year, and the state that is not yet closed (if any) starts after the year
+        """
+        if now is None: #end of the time series
+            return True
+        return year <= now - self._window + 1 and (self._run_start is None or self._run_start > year)
+    
+    def _classify(self,now):
+        "Classify the pending candidates (in order), as far as the states around them are final"
+        classified = []
+        while self._pending and self._final(self._pending[0].year + self._margin,now):
+            cand = self._pending.popleft()
+            cand.before = self._state_at(cand.year - self._margin)
+            cand.after = self._state_at(cand.year + self._margin)
+            
+            #duplicates
+            key = (cand.before,cand.after)
+            if key in self._groups:
+                first = self._groups[key]
+                first.duptype = 'dup_first'
+                if hasattr(first,'dups_with'):
+                    first.dups_with.append(cand.year)
+                else:
+                    first.dups_with = [cand.year]
+                cand.duptype = 'dup'
+            else:
+                self._groups[key] = cand
+            
+            #classification
+            if cand.before == cand.after:
+                cand.Type = 'sw'
+            elif cand.before is not None:
+                cand.Type = 'real' if cand.after is not None else 'ob'
+            else:
+                cand.Type = 'oa' if cand.after is not None else 'no'
+            if cand.Type == 'real': #criterion 3
+                mean_state_before = self.state_means[cand.before]
+                mean_state_after = self.state_means[cand.after]
+                difference = mean_state_after - mean_state_before
+                if not mean_state_before == 0:
+                    perc_diff = 100 * abs(difference / mean_state_before)
+                    if perc_diff <= self.c3: cand.Type = 'us'
+                else: cand.Type = 'zd'
+            
+            self.allSETPs_cands.append(cand)
+            classified.append(cand)
+            self._update_first_SETP(cand)
+        return classified
+    
+    def _update_first_SETP(self,cand):
+        """
+        Check if the first SETP is known. Candidates are classified in order, so the first selected 
+        candidate is final when it is found. The first 'ob' is only final if no earlier candidate 
+        can be selected as an addition (a duplicate of a positive candidate, see select_from_candidates).
+        """
+        if self.done or cand.sign != self.sign:
+            return
+        if cand.Type == 'real' and cand.duptype != 'dup':
+            self._first_main = cand.year
+            self.first_SETP = cand.year if self._first_ob is None else min(cand.year,self._first_ob)
+            self.done = True
+        elif cand.Type == 'real' and self._groups[(cand.before,cand.after)].sign == 1:
+            self._additions = True
+        elif cand.Type == 'ob' and self._first_ob is None:
+            self._first_ob = cand.year
+            if not self._additions:
+                self.first_SETP = cand.year
+                self.done = True
+
+
 def add_suptitle(fig, exp, M):
     """Add some information about the experiment as title to a figure created with M.plot_SETPs
 
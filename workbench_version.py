@@ -3,41 +3,243 @@ import copy
 from collections import OrderedDict
 import csv
 from datetime import datetime
+import itertools
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+import multiprocessing
 import numpy as np
 import os
+import pandas as pd
 from pathlib import Path
 import pickle
+import tipping as tp
+
+import mayors #defines the mayors that ExperimentHandles can refer to
+from models import Rotty
+from run_model import run_model01 #import the model flow
+
+
+class ScenarioStore():
+    """
+    Per-process cache of the scenario objects used by run_model_workbench()
+    
+    The SLR scenarios are loaded from the pickles once (at the first call), SurgeHeights and 
+    SurgeLevels are created at the first time they are asked for, and then reused by all 
+    following experiments in the same (worker) process. The number of SurgeHeights and 
+    SurgeLevels kept in memory is bounded: the least recently used ones are removed first. 
+    These objects are not added to allSurgeHeight and allSurgeLevel, so removing them from the 
+    store frees their memory.
+    
+    If a scenario folder contains a bundle (see classes.pack_scenarios), the scenarios are read 
+    from the (memory-mapped) bundle instead of from the pickles and csv files.
+    
+    Arguments:
+        *SLR_folder* (Path) : folder containing the SLR_Scenario pickles
+        *maxsize* (int) : maximum number of SurgeHeight and of SurgeLevel objects kept in memory
+    """
+    def __init__(self,SLR_folder=Path("SLR_projections","Transients"),maxsize=128):
+        self.SLR_folder = SLR_folder
+        self.maxsize = maxsize
+        self._SLR_Scenarios = None #dict: SLR id ('01') -> SLR_Scenario object
+        self._bundles = {} #folder -> ScenarioBundle object (None if the folder has no bundle)
+        self._SurgeHeights = OrderedDict() #transient path -> SurgeHeight object
+        self._SurgeLevels = OrderedDict() #(SLR id, transient path) -> SurgeLevel object
+    
+    def SLR_Scenario(self,SLR):
+        """
+        Arguments:
+            *SLR* (string) : id of the SLR scenario e.g. '01'
+        
+        Returns:
+            *SLR_obj* (SLR_Scenario object)
+        """
+        if self._SLR_Scenarios is None: #load all SLR scenarios available as pickles (or in the bundle)
+            bundle = self.bundle(self.SLR_folder)
+            if bundle is not None:
+                allSLR = [bundle.SLR_Scenario(name) for name in bundle.names]
+            else:
+                allSLR = SLR_Scenario_from_pickles(self.SLR_folder)
+            self._SLR_Scenarios = {x.name.split('__')[0].split('_')[1] : x for x in allSLR}
+        return self._SLR_Scenarios[SLR]
+    
+    def SurgeHeight(self,transient):
+        """
+        Arguments:
+            *transient* (Path) : path to the csv file of the transient storm surge scenario
+        
+        Returns:
+            *SH_obj* (SurgeHeight object)
+        """
+        transient = Path(transient)
+        key = str(transient)
+        if key in self._SurgeHeights:
+            self._SurgeHeights.move_to_end(key)
+            return self._SurgeHeights[key]
+        bundle = self.bundle(transient.parent)
+        if bundle is not None and transient.stem in bundle:
+            SH_obj = bundle.SurgeHeight(transient.stem,register=False)
+        else:
+            SH_obj = SurgeHeight(transient.stem,register=False)
+            SH_obj.from_csv(transient)
+        self._add(self._SurgeHeights,key,SH_obj)
+        return SH_obj
+    
+    def SurgeLevel(self,SLR,transient):
+        """
+        Arguments:
+            *SLR* (string) : id of the SLR scenario e.g. '01'
+            *transient* (Path) : path to the csv file of the transient storm surge scenario
+        
+        Returns:
+            *SurgeLevel* (SurgeLevel object) : the combination of both scenarios
+        """
+        key = (SLR,str(Path(transient)))
+        if key in self._SurgeLevels:
+            self._SurgeLevels.move_to_end(key)
+            return self._SurgeLevels[key]
+        SurgeLevel = combine_SurgeLevel(self.SLR_Scenario(SLR),self.SurgeHeight(transient),register=False)
+        self._add(self._SurgeLevels,key,SurgeLevel)
+        return SurgeLevel
+    
+    def bundle(self,folder):
+        """
+        Returns:
+            *bundle* (ScenarioBundle) : the bundle in the folder, None if it has none
+        """
+        key = str(folder)
+        if key not in self._bundles:
+            path = Path(folder,bundle_filename)
+            self._bundles[key] = ScenarioBundle(path) if path.exists() else None
+        return self._bundles[key]
+    
+    def preload(self,transients):
+        """
+        Load the SurgeHeights of all transients at once, e.g. before worker processes are forked
+        (which then share them). The maxsize is increased if needed to keep them all in memory.
+        
+        Arguments:
+            *transients* (iterable of Paths) : csv files of the transient storm surge scenarios
+        """
+        transients = {str(Path(transient)) : transient for transient in transients}
+        self.maxsize = max(self.maxsize,len(transients))
+        for transient in transients.values():
+            self.SurgeHeight(transient)
+    
+    def _add(self,cache,key,value):
+        cache[key] = value
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False) #remove the least recently used item
+    
+    def clear(self):
+        "Remove all scenarios from memory (e.g. after the scenario files have changed)"
+        self._SLR_Scenarios = None
+        self._bundles = {}
+        self._SurgeHeights.clear()
+        self._SurgeLevels.clear()
+
+scenario_store = ScenarioStore() #shared by all experiments in this process
+
 
 def run_model_workbench(SLR,transient,Mayor,Housing_market,implementation_time,do_print=False):  
+    """
+    Run the model for one experiment of the EMA workbench
     
-    #IMPORT MODEL
-    from models import Rotty
-    from run_model import run_model01 #import the model flow
+    The simulation does not depend on the Housing_market: it only selects which of the 
+    outcomes (the objective or subjective house prices) are returned. The outcomes for both
+    housing markets are therefore calculated at once, and kept in memory (see OutcomeCache),
+    so that the other Housing_market value of the same experiment does not run the model again.
+    With the EMA workbench, use run_model_workbench_both() instead, which returns both at once.
     
-    Model = Rotty #this can also be an argument of the function
+    Returns:
+        *HP_hp_2200, CC_hp_2200* (floats) : house prices in 2200 in both areas
+        *HP_first_SETP, CC_first_SETP* (ints) : year of the first SETP in both areas (9999 if none)
+    """
+    outcomes = outcome_cache.get(SLR,transient,Mayor,implementation_time)
+    return outcomes[Housing_market]
+
+
+def convert_implementation_time(implementation_time):
+    """
+    Implementation times of the small and large measure, from the implementation time of the small measure
+    
+    Arguments:
+        *implementation_time* (int) : implementation time of the small measure in years
+    
+    Returns:
+        *Implementation_time* (tuple) : implementation times of the small and large measure (as used by run_model01)
+    """
+    return (implementation_time,int(round(implementation_time*10/7,0)))
+
+
+def last_timestep_needed(Model,time,outcome_timesteps):
+    """
+    The last timestep that the outcomes of run_model_workbench() depend on
+    
+    The house prices are only calculated while more than house_price_horizon years remain, so the 
+    metrics (and their tipping points) do not change after that. The model does not look ahead, so 
+    the timesteps up to this one do not depend on later timesteps.
     
-    #IMPORT SLR Scenario
-    #load all SLR scenarios available as pickles
-    allSLR_Scenario = SLR_Scenario_from_pickles(Path("SLR_projections","Transients"))
-    #and select the right one
-    SLR_obj = [x for x in allSLR_Scenario if x.name.split('__')[0].split('_')[1] == SLR][0]
+    Arguments:
+        *Model* (Model object) : the model
+        *time* (list) : the years of the experiment
+        *outcome_timesteps* (list of ints) : timesteps of which the value is an outcome (e.g. 179 for 2200)
     
-    #Import SurgeHeight
-    SH_obj = SurgeHeight(transient.stem)
-    SH_obj.from_csv(transient)
+    Returns:
+        *last_timestep* (int) : index of the last timestep to simulate
+    """
+    last_house_price = max(len(time) - RA.house_price_horizon - 1 for RA in Model.allResidentialArea)
+    return min(len(time) - 1, max(max(outcome_timesteps),last_house_price))
+
+
+def workbench_outcomes(SLR,transient,Mayor,implementation_time,early_termination=True):
+    """
+    Run the model and the tipping point analysis, for both types of housing market
+    
+    Arguments: see run_model_workbench()
+        *early_termination* (bool) : only simulate and analyse the timesteps that the outcomes
+                                     depend on (see last_timestep_needed), the outcomes are the same
+    
+    Returns:
+        *outcomes* (dict) : keys 'rational' and 'boundedly_rational', 
+                            values (HP_hp_2200, CC_hp_2200, HP_first_SETP, CC_first_SETP)
+                            key 'timesteps_saved' : number of timesteps that were not simulated
+    """
+    Model = Rotty #this can also be an argument of the function
     
-    #Combine SLR and SurgeHeight scenario to SurgeLevel
-    SurgeLevel = combine_SurgeLevel(SLR_obj,SH_obj) 
+    #Get the SurgeLevel (= SLR scenario + SurgeHeight) from the scenarios already loaded in this process
+    SurgeLevel = scenario_store.SurgeLevel(SLR,transient)
     
     #Convert implementation time to format we can use
-    implementation_time = (implementation_time,int(round(implementation_time*10/7,0)))
+    implementation_time = convert_implementation_time(implementation_time)
     
-    experiment = run_model01(Rotty,SurgeLevel,Mayor,Implementation_time=implementation_time,do_print=False)
+    timestep_2200 = 179 #timestep of which the house price is returned
+    time = SurgeLevel.years
+    if early_termination:
+        last_timestep = last_timestep_needed(Model,time,[timestep_2200])
+    else:
+        last_timestep = len(time) - 1
     
-    def Average(lst): 
-        return sum(lst) / len(lst) 
+    ########################################################
+    ##### TIPPING POINT ANALYSIS, WHILE THE MODEL RUNS #####
+    ########################################################
+    
+    window = 4 #The size of the rolling window
+    margin = 3 # The margin around the TP
+
+    #Criteria
+    c1 = 0.15
+    c2 = 1e9 #variance
+    c3 = 10 #percent
+    
+    #The metrics (in the same order as experiment.create_Metrics()), analysed in each timestep of the run;
+    #after the last timestep the detectors receive one NaN, which closes the stable states as in the full time series.
+    #(the run can not stop earlier than last_timestep: the house price in 2200 is needed as well)
+    variables = [(RA.name,variable) for RA in Model.allResidentialArea 
+                 for variable in ('house_price_t_objective','house_price_t_subjective')]
+    detectors = {key : tp.SETPDetector(key,time[0],window,c1,c2,c3,margin,sign=-1) for key in variables}
+    
+    experiment = run_model01(Model,SurgeLevel,Mayor,Implementation_time=implementation_time,do_print=False,
+                             detectors=detectors,last_timestep=last_timestep)
     
     Model = experiment.Model
     
@@ -54,61 +256,516 @@ def run_model_workbench(SLR,transient,Mayor,Housing_market,implementation_time,d
     CC_hp_t_sub = [x  if x > 0 else 0 for x in CC.house_price_t_subjective]
     
     #Also return the value of the timeseries in 2200
-    HP_hp_2200_obj = HP_hp_t_obj[179]
-    HP_hp_2200_sub = HP_hp_t_sub[179]
-    CC_hp_2200_obj = CC_hp_t_obj[179]
-    CC_hp_2200_sub = CC_hp_t_sub[179]
+    HP_hp_2200_obj = HP_hp_t_obj[timestep_2200]
+    HP_hp_2200_sub = HP_hp_t_sub[timestep_2200]
+    CC_hp_2200_obj = CC_hp_t_obj[timestep_2200]
+    CC_hp_2200_sub = CC_hp_t_sub[timestep_2200]
     
-    #######################################################
-    ##### DO TIPPING POINT ANALYSIS ON MODEL OUTCOMES #####
-    #######################################################
+    first_SETPs = [int(detectors[key].first_SETP) if detectors[key].first_SETP is not None else 9999 for key in variables]
     
-    window = 4 #The size of the rolling window
-    margin = 3 # The margin around the TP
+    #The values to return for each type of housing market (R0 or R1)
+    outcomes = {'rational' : (HP_hp_2200_obj, CC_hp_2200_obj, first_SETPs[0], first_SETPs[2]),
+                'boundedly_rational' : (HP_hp_2200_sub, CC_hp_2200_sub, first_SETPs[1], first_SETPs[3]),
+                'timesteps_saved' : len(time) - 1 - last_timestep}
+    return outcomes
 
-    #Criteria
-    c1 = 0.15
-    c2 = 1e9 #variance
-    c3 = 10 #percent
-    experiment.create_Metrics()
-    
-    for M in experiment.allMetrics:
-        M.create_statistics(window=window) #Create summary statistics for the metric(t)
-        M.find_SETP_candidates(c1=c1,c2=c2,c3=c3,margin=margin) #Evaluate the three tipping point criteria
-        M.select_SETPs(sign=-1)
-           
-    
-        if not len(M.selected_SETPs) == 0: #only if it has any SETPs
-            first_real = M.selected_SETPs[0] #the first real tipping point
-            if not len(M.candidates_as_lists[3]) == 0: #only if any of these exist
-                first_only_before = M.candidates_as_lists[3][0]
-                M.first_SETP = min(first_real,first_only_before)
-            else: #only the 'real tipping point list' has items:
-                M.first_SETP = first_real
-        elif not len(M.candidates_as_lists[3]) == 0: #but there is an example of 'only stable before'
-            first_only_before = M.candidates_as_lists[3][0]
-            M.first_SETP = first_only_before
-        else: M.first_SETP = None #both types do not exist
-    
-    #Decide on which value to return using type of housing market (R0 or R1)
-    if Housing_market == 'rational':
-        HP_first_SETP = experiment.allMetrics[0].first_SETP
-        CC_first_SETP = experiment.allMetrics[2].first_SETP
-        HP_hp_2200 = HP_hp_2200_obj
-        CC_hp_2200 = CC_hp_2200_obj
-    elif Housing_market == 'boundedly_rational':
-        HP_first_SETP = experiment.allMetrics[1].first_SETP
-        CC_first_SETP = experiment.allMetrics[3].first_SETP
-        HP_hp_2200 = HP_hp_2200_sub
-        CC_hp_2200 = CC_hp_2200_sub
-    
-    if HP_first_SETP is None: 
-        HP_first_SETP = 9999
-    if CC_first_SETP is None: 
-        CC_first_SETP = 9999
+
+class OutcomeCache():
+    """
+    Per-process memo of workbench_outcomes(), keyed on (SLR, transient, Mayor, implementation_time)
+    
+    The Mayor is identified by its name, because the workbench may send a new (copy of the) 
+    Mayor object with every experiment. When more than maxsize experiments are stored, the
+    least recently used ones are removed first.
+    
+    Both Housing_market values of an experiment are asked for at once by workbench_rows() 
+    (used by Sweep and run_model_workbench_both()), so each experiment runs the model once.
+    
+    Arguments:
+        *maxsize* (int) : maximum number of experiments kept in memory
+    """
+    def __init__(self,maxsize=4096):
+        self.maxsize = maxsize
+        self._outcomes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.timesteps_saved = 0 #total number of timesteps not simulated (see last_timestep_needed)
+    
+    def get(self,SLR,transient,Mayor,implementation_time):
+        key = (SLR,str(Path(transient)),Mayor.get_name(),implementation_time)
+        if key in self._outcomes:
+            self.hits += 1
+            self._outcomes.move_to_end(key)
+            return self._outcomes[key]
+        self.misses += 1
+        outcomes = workbench_outcomes(SLR,transient,Mayor,implementation_time)
+        self.timesteps_saved += outcomes['timesteps_saved']
+        self._outcomes[key] = outcomes
+        if len(self._outcomes) > self.maxsize:
+            self._outcomes.popitem(last=False) #remove the least recently used item
+        return outcomes
+    
+    def clear(self):
+        self._outcomes.clear()
+
+outcome_cache = OutcomeCache() #shared by all experiments in this process
+
+
+################################ RUN MANY EXPERIMENTS IN PARALLEL ########################################
+
+def experiment_grid(SLRs,transients,implementation_times,Mayors):
+    """
+    All combinations (full factorial) of the uncertainties and levers, in a fixed order
+    
+    The SLR scenario changes slowest and the Mayor fastest, so that consecutive experiments 
+    (and therefore the experiments in one chunk, see run_parallel) share their SurgeLevel.
+    
+    Arguments:
+        *SLRs* (list of strings) : ids of the SLR scenarios e.g. ['01','02']
+        *transients* (list of Paths) : csv files of the transient storm surge scenarios
+        *implementation_times* (list of ints) : implementation times of the small measure
+        *Mayors* (list of Mayor objects) : the mayors
+    
+    Returns:
+        *experiments* (list of tuples) : (SLR, transient, Mayor, implementation_time) for each experiment
+    """
+    return [(SLR,transient,Mayor,implementation_time) for SLR,transient,implementation_time,Mayor 
+            in itertools.product(SLRs,transients,implementation_times,Mayors)]
+
+def run_record(SLR,transient,Mayor,implementation_time):
+    """
+    Run the model for one experiment, and only keep the time series of the results
+    
+    Arguments: see run_model_workbench()
+    
+    Returns:
+        *record* (ExperimentRecord) : compact version of the experiment, cheap to send between processes
+                                      (the SurgeLevel is not sent, see ExperimentRecord)
+    """
+    SurgeLevel = scenario_store.SurgeLevel(SLR,transient)
+    experiment = run_model01(Rotty,SurgeLevel,Mayor,Implementation_time=convert_implementation_time(implementation_time))
+    return experiment.to_record()
+
+_pool_task = None #(function, experiments) that the workers of run_parallel() work on
+
+def _init_worker(task,maxsize):
+    "Initializer of the worker processes: only receives the task if the workers are not forked"
+    global _pool_task
+    if task is not None:
+        _pool_task = task
+    scenario_store.maxsize = max(scenario_store.maxsize,maxsize) #keep all SurgeHeights of the task
+
+def _run_chunk(bounds):
+    "Run the experiments with index start up to stop, in a worker process"
+    start, stop = bounds
+    function, experiments = _pool_task
+    return start, [function(*experiments[k]) for k in range(start,stop)]
+
+def run_parallel(experiments,function=workbench_outcomes,processes=None,chunksize=None,do_print=False):
+    """
+    Run many experiments on all cores
+    
+    The worker processes are started once. Where possible (Linux) they are forked, so they share 
+    the experiments and the scenarios, which are all loaded in this process first (copy-on-write), 
+    and nothing is pickled per experiment: the workers only receive (start, stop) indices of a chunk of 
+    experiments, and return the compact results of the whole chunk. Scenario bundles (see 
+    classes.pack_scenarios) are memory-mapped, so all workers read the same pages from the disk cache.
+    On platforms that cannot fork, the experiments are sent once to each worker, and each worker 
+    loads each scenario at most once.
+    
+    Arguments:
+        *experiments* (list of tuples) : arguments of function for each experiment, e.g. from experiment_grid()
+        *function* (function) : runs one experiment, e.g. workbench_outcomes or run_record
+        *processes* (int) : number of worker processes, defaults to the number of cores; 1 runs in this process
+        *chunksize* (int) : number of experiments per chunk, defaults to about 4 chunks per process
+        *do_print* (bool) : print the progress
+    
+    Returns:
+        *results* (list) : the result of function for each experiment, in the same order as experiments
+    """
+    experiments = list(experiments)
+    n = len(experiments)
+    if n == 0:
+        return []
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes,n)
+    if chunksize is None:
+        chunksize = max(1,n // (4*processes))
+    chunks = [(start,min(start+chunksize,n)) for start in range(0,n,chunksize)]
+    
+    results = [None] * n
+    for done, (start, chunk_results) in enumerate(run_chunks(experiments,chunks,function,processes),1):
+        results[start:start+len(chunk_results)] = chunk_results
+        if do_print:
+            print("Finished chunk {} of {} ({} experiments)".format(done,len(chunks),n))
+    return results
+
+def run_chunks(experiments,chunks,function=workbench_outcomes,processes=None):
+    """
+    Run chunks of experiments on all cores, and yield the results of each chunk as soon as it is finished
+    
+    See run_parallel() for how the work is divided over the worker processes.
+    
+    Arguments:
+        *experiments* (list of tuples) : arguments of function for each experiment
+        *chunks* (list of tuples) : (start, stop) indices of the experiments in each chunk
+        *function* (function) : runs one experiment, e.g. workbench_outcomes or run_record
+        *processes* (int) : number of worker processes, defaults to the number of cores; 1 runs in this process
+    
+    Yields:
+        *start* (int) : index of the first experiment of the chunk
+        *chunk_results* (list) : the result of function for each experiment in the chunk
+    """
+    global _pool_task
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1,min(processes,len(chunks)))
+    
+    #Load the scenarios before the workers are forked, so that they share them (no worker parses them again)
+    for SLR in {experiment[0] for experiment in experiments}:
+        scenario_store.SLR_Scenario(SLR)
+    scenario_store.preload(experiment[1] for experiment in experiments)
+    
+    _pool_task = (function,experiments)
+    pool = None
+    try:
+        if processes == 1:
+            yield from map(_run_chunk,chunks)
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context, task = multiprocessing.get_context('fork'), None #workers inherit _pool_task
+            else:
+                context, task = multiprocessing.get_context(), _pool_task
+            pool = context.Pool(processes,initializer=_init_worker,initargs=(task,scenario_store.maxsize))
+            yield from pool.imap_unordered(_run_chunk,chunks)
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _pool_task = None
+
+
+housing_markets = ['rational','boundedly_rational']
+workbench_outcome_names = ['HP_hp_2200','CC_hp_2200','HP_first_SETP','CC_first_SETP']
+
+def workbench_rows(SLR,transient,Mayor,implementation_time):
+    """
+    Outcomes of run_model_workbench() for both housing markets of one experiment
+    
+    Returns:
+        *rows* (list of tuples) : the outcomes of run_model_workbench() for each of housing_markets
+    """
+    return [run_model_workbench(SLR,transient,Mayor,Housing_market,implementation_time) for Housing_market in housing_markets]
+
+#Outcomes of run_model_workbench_both(): the outcomes for each housing market, e.g. 'HP_hp_2200_rational'
+workbench_outcome_names_both = ['{}_{}'.format(name,Housing_market) for Housing_market in housing_markets 
+                                for name in workbench_outcome_names]
+
+def run_model_workbench_both(SLR,transient,Mayor,implementation_time):
+    """
+    Run the model for one experiment of the EMA workbench, and return the outcomes for both housing markets
+    
+    Use this function (with workbench_outcome_names_both as outcomes, and without Housing_market as 
+    uncertainty) so that the workbench runs each experiment once, instead of once per housing market 
+    (see 30_EMA_Workbench_run.ipynb). stack_housing_markets() converts the results to one row per 
+    housing market, as those of run_model_workbench() with Housing_market as uncertainty.
+    
+    Returns:
+        *outcomes* (tuple) : the outcomes of run_model_workbench() for each of housing_markets, 
+                             in the order of workbench_outcome_names_both
+    """
+    return tuple(outcome for row in workbench_rows(SLR,transient,Mayor,implementation_time) for outcome in row)
+
+def stack_housing_markets(experiments,outcomes):
+    """
+    Convert the results of run_model_workbench_both() to one row per experiment and housing market, 
+    with the column Housing_market (e.g. for feature scoring, PRIM and dimensional stacking)
+    
+    Arguments:
+        *experiments* (DataFrame) : the experiments returned by perform_experiments()
+        *outcomes* (dict) : the outcomes returned by perform_experiments(), keys workbench_outcome_names_both
+    
+    Returns:
+        *experiments* (DataFrame) : the experiments for each of housing_markets (in that order), with the column Housing_market
+        *outcomes* (dict) : keys workbench_outcome_names, in the same order as experiments
+    """
+    frames = []
+    for Housing_market in housing_markets:
+        frame = experiments.copy()
+        #at the position of the uncertainty in earlier versions (before implementation_time)
+        loc = frame.columns.get_loc('implementation_time') if 'implementation_time' in frame.columns else len(frame.columns)
+        frame.insert(loc,'Housing_market',pd.Categorical([Housing_market] * len(frame),categories=housing_markets))
+        frames.append(frame)
+    stacked_outcomes = {name : np.concatenate([np.asarray(outcomes['{}_{}'.format(name,Housing_market)]) 
+                                               for Housing_market in housing_markets])
+                        for name in workbench_outcome_names}
+    return pd.concat(frames,ignore_index=True), stacked_outcomes
+
+
+class Sweep():
+    """
+    Resumable run of the full factorial (SLR x transient x implementation_time x Mayor) of workbench experiments
+    
+    The experiments are divided in chunks that are always the same for the same factorial. 
+    Each finished chunk is immediately saved in its own file in the folder, so that the results 
+    of all finished chunks are kept if the run stops (e.g. a crash or the end of a job on a cluster). 
+    Running the same sweep again only runs the chunks that are not yet saved. The experiments 
+    themselves are run with run_model_workbench(), for both housing markets.
+    
+    Arguments:
+        *folder* (Path) : folder where the results are saved
+        *SLRs* (list of strings) : ids of the SLR scenarios e.g. ['01','02']
+        *transients* (list of Paths) : csv files of the transient storm surge scenarios
+        *implementation_times* (list of ints) : implementation times of the small measure
+        *Mayors* (list of Mayor objects) : the mayors
+        *chunksize* (int) : number of experiments per chunk
+    """
+    definition_filename = "sweep.p"
+    
+    def __init__(self,folder,SLRs,transients,implementation_times,Mayors,chunksize=500):
+        self.folder = Path(folder)
+        self.experiments = experiment_grid(SLRs,transients,implementation_times,Mayors)
+        n = len(self.experiments)
+        self.chunks = [(start,min(start+chunksize,n)) for start in range(0,n,chunksize)]
+        self.definition = {'SLRs' : [str(SLR) for SLR in SLRs],
+                           'transients' : [str(Path(transient)) for transient in transients],
+                           'implementation_times' : [int(it) for it in implementation_times],
+                           'Mayors' : [Mayor.get_name() for Mayor in Mayors],
+                           'chunksize' : chunksize}
+        self._check_definition()
+    
+    def _check_definition(self):
+        "Save the definition of the sweep, or check that the saved results are from the same sweep"
+        path = Path(self.folder,self.definition_filename)
+        if path.exists():
+            with open(path,'rb') as f:
+                saved = pickle.load(f)
+            if saved != self.definition:
+                raise ValueError("The results in {} are from another sweep (other experiments or chunksize)".format(self.folder))
+        else:
+            self.folder.mkdir(parents=True,exist_ok=True)
+            with open(path,'wb') as f:
+                pickle.dump(self.definition,f)
+    
+    def chunk_path(self,k):
+        return Path(self.folder,"chunk_{:06d}.npy".format(k))
+    
+    def completed(self):
+        "Numbers of the chunks of which the results are saved"
+        return [k for k in range(len(self.chunks)) if self.chunk_path(k).exists()]
+    
+    def remaining(self):
+        "Numbers of the chunks that still have to be run"
+        return [k for k in range(len(self.chunks)) if not self.chunk_path(k).exists()]
+    
+    def run(self,processes=None,do_print=False):
+        """
+        Run all chunks that are not yet saved (see run_chunks), and save each chunk as soon as it is finished
+        
+        Arguments:
+            *processes* (int) : number of worker processes, defaults to the number of cores
+            *do_print* (bool) : print the progress
+        
+        Returns:
+            *results* (DataFrame) : results of the whole sweep, see results()
+        """
+        todo = self.remaining()
+        if do_print:
+            print("{} of {} chunks already finished".format(len(self.chunks) - len(todo),len(self.chunks)))
+        chunk_number = {self.chunks[k][0] : k for k in todo} #start index -> chunk number
+        finished = run_chunks(self.experiments,[self.chunks[k] for k in todo],workbench_rows,processes)
+        for done, (start, chunk_results) in enumerate(finished,1):
+            self._save_chunk(chunk_number[start],chunk_results)
+            if do_print:
+                print("Finished chunk {} ({} of {} remaining)".format(chunk_number[start],done,len(todo)))
+        return self.results()
+    
+    def _dtype(self):
+        "One row per experiment and housing market: the uncertainties, levers and outcomes"
+        length = lambda values : max([len(value) for value in values] + [1])
+        return np.dtype([('SLR','U{}'.format(length(self.definition['SLRs']))),
+                         ('transient','U{}'.format(length(self.definition['transients']))),
+                         ('Housing_market','U{}'.format(length(housing_markets))),
+                         ('implementation_time',np.int64),
+                         ('Mayor','U{}'.format(length(self.definition['Mayors']))),
+                         ('HP_hp_2200',np.float64),
+                         ('CC_hp_2200',np.float64),
+                         ('HP_first_SETP',np.int64),
+                         ('CC_first_SETP',np.int64)])
+    
+    def _save_chunk(self,k,chunk_results):
+        start, stop = self.chunks[k]
+        rows = []
+        for (SLR,transient,Mayor,implementation_time), outcomes in zip(self.experiments[start:stop],chunk_results):
+            for Housing_market, outcome in zip(housing_markets,outcomes):
+                rows.append((SLR,str(Path(transient)),Housing_market,implementation_time,Mayor.get_name()) + tuple(outcome))
+        #Write to a temporary file first, so that a chunk file is never incomplete
+        path = self.chunk_path(k)
+        temp = path.with_suffix('.tmp')
+        with open(temp,'wb') as f:
+            np.save(f,np.array(rows,dtype=self._dtype()))
+        os.replace(temp,path)
+    
+    def results(self):
+        """
+        Results of all finished chunks
+        
+        Returns:
+            *results* (DataFrame) : one row per experiment and housing market, with the uncertainties 
+                                    and levers (as in the Workbench) and the outcomes (workbench_outcome_names)
+        """
+        arrays = [np.load(self.chunk_path(k)) for k in self.completed()]
+        if not arrays:
+            return pd.DataFrame(np.zeros(0,dtype=self._dtype()))
+        return pd.DataFrame(np.concatenate(arrays))
+    
+    def handles(self):
+        """
+        Handles of all experiments in the finished chunks, with the outcomes as summary
+        
+        Returns:
+            *handles* (list of ExperimentHandles) : summary {Housing_market : outcomes}
+        """
+        handles = []
+        for k in self.completed():
+            start, stop = self.chunks[k]
+            rows = np.load(self.chunk_path(k))
+            for j, (SLR,transient,Mayor,implementation_time) in enumerate(self.experiments[start:stop]):
+                summary = {str(row['Housing_market']) : tuple(row[name].item() for name in workbench_outcome_names) 
+                           for row in rows[len(housing_markets)*j:len(housing_markets)*(j+1)]}
+                handles.append(ExperimentHandle(SLR,transient,Mayor,implementation_time,summary=summary))
+        return handles
+    
+    def __repr__(self):
+        return "Sweep of {} experiments in {} ({} of {} chunks finished)".format(
+            len(self.experiments),self.folder,len(self.completed()),len(self.chunks))
+
+
+################################ LAZY EXPERIMENTS ########################################
+
+model_registry = {Rotty.name : Rotty} #models that ExperimentHandles can refer to, by name
+
+def mayor_from_name(name):
+    """
+    Arguments:
+        *name* (string) : name of the mayor, as returned by Mayor.get_name() e.g. 'Sentiment'
+    
+    Returns:
+        *Mayor* (Mayor object) : a new mayor with this name
+    """
+    for cls in mayors.mayor_classes().values():
+        if cls().get_name() == name:
+            return cls()
+    raise ValueError("No mayor with the name {}".format(name))
+
+
+class ExperimentHandle():
+    """
+    Reference to an experiment, that is only run when its results are used
+    
+    Only stores the keys of the experiment (and optionally a small summary of the outcomes), so 
+    many handles take little memory. The model is deterministic: the first time the results are
+    used (to_df, create_Metrics), the experiment is run again with run_model01 and kept in 
+    experiment_cache, which keeps a limited number of experiments.
+    
+    Arguments:
+        *SLR* (string) : id of the SLR scenario e.g. '01'
+        *transient* (Path) : csv file of the transient storm surge scenario
+        *Mayor* (Mayor object/string) : the mayor, or its name
+        *ImplementationTime* (tuple/int) : implementation times of the small and large measure,
+                                           or only of the small measure (as in the workbench)
+        *model* (string) : name of the model in model_registry
+        *summary* (any) : small summary of the outcomes, e.g. from Sweep.handles()
+    """
+    __slots__ = ('model','SLR','transient','mayor','ImplementationTime','summary')
+    
+    def __init__(self,SLR,transient,Mayor,ImplementationTime,model='Rotty',summary=None):
+        self.model = model
+        self.SLR = SLR
+        self.transient = str(Path(transient))
+        self.mayor = Mayor if isinstance(Mayor,str) else Mayor.get_name()
+        if isinstance(ImplementationTime,(int,np.integer)):
+            ImplementationTime = convert_implementation_time(int(ImplementationTime))
+        self.ImplementationTime = tuple(ImplementationTime)
+        self.summary = summary
+    
+    def key(self):
+        return (self.model,self.SLR,self.transient,self.mayor,self.ImplementationTime)
+    
+    @property
+    def SLR_Scenario(self):
+        "Name of the SLR scenario (as ExperimentRecord.SLR_Scenario)"
+        return scenario_store.SLR_Scenario(self.SLR).name
+    
+    @property
+    def SurgeHeight(self):
+        "Name of the SurgeHeight scenario (as ExperimentRecord.SurgeHeight)"
+        return Path(self.transient).stem
+    
+    @property
+    def name(self):
+        return "{}_{}_{}_{}".format(self.model,scenario_store.SurgeLevel(self.SLR,self.transient).name,
+                                    self.mayor,str(self.ImplementationTime))
+    
+    def __repr__(self):
+        return "ExperimentHandle " + self.name
+    
+    def experiment(self):
+        """
+        Returns:
+            *experiment* (Experiment) : the experiment, run now if it is not in experiment_cache
+        """
+        return experiment_cache.get(self)
+    
+    def to_df(self):
+        "Same as Experiment.to_df()"
+        return self.experiment().to_df()
+    
+    def create_Metrics(self):
+        """
+        Output metrics of interest, same as Experiment.create_Metrics()
         
+        Returns:
+            *allMetrics* (list) : list of tipping.Metric objects
+        """
+        experiment = self.experiment()
+        experiment.create_Metrics()
+        return experiment.allMetrics
+
+
+class ExperimentCache():
+    """
+    Per-process cache of the experiments that are run for ExperimentHandles
     
-    return HP_hp_2200, CC_hp_2200, HP_first_SETP, CC_first_SETP
+    Arguments:
+        *maxsize* (int) : maximum number of experiments kept in memory, the least recently used ones are removed first
+    """
+    def __init__(self,maxsize=64):
+        self.maxsize = maxsize
+        self._experiments = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self,handle):
+        key = handle.key()
+        if key in self._experiments:
+            self.hits += 1
+            self._experiments.move_to_end(key)
+            return self._experiments[key]
+        self.misses += 1
+        experiment = run_model01(model_registry[handle.model],scenario_store.SurgeLevel(handle.SLR,handle.transient),
+                                 mayor_from_name(handle.mayor),Implementation_time=handle.ImplementationTime)
+        self._experiments[key] = experiment
+        if len(self._experiments) > self.maxsize:
+            self._experiments.popitem(last=False) #remove the least recently used item
+        return experiment
+    
+    def clear(self):
+        self._experiments.clear()
+
+experiment_cache = ExperimentCache() #shared by all ExperimentHandles in this process
     
 def init_time(Model,time,do_print=False):
     """